@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Compare the memory used by the items of the feeds, as dicts (the format of
+the response) or as FeedItem (the format kept in the feeds cache).
+
+Usage::
+
+    python benchmarks/items_memory.py --feeds 200 --items 100
+"""
+from redturtle.rssservice.rss_mixer import FeedItem
+
+import click
+import gc
+import tracemalloc
+
+
+def make_dict(feed, index):
+    # strings are built like the parsed ones: every item has its own copies
+    return {
+        "title": f"News {index} of feed {feed}",
+        "url": f"https://www.example.com/feed-{feed}/news-{index}",
+        "contentSnippet": f"<p>Some news about {index} from feed {feed}.</p>",
+        "source": "".join(["Feed ", str(feed)]),
+        "date": f"2020-04-{index % 28 + 1:02}T10:44:01+00:00",
+        "enclosure": {"url": f"https://www.example.com/feed-{feed}/{index}.jpg"},
+        "categories": ["news", f"category {index % 5}"],
+    }
+
+
+def measure(feeds, items, make):
+    gc.collect()
+    tracemalloc.start()
+    data = [[make(feed, index) for index in range(items)] for feed in range(feeds)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return size
+
+
+@click.command()
+@click.option("--feeds", default=200, help="Number of feeds.")
+@click.option("--items", default=100, help="Items of each feed.")
+def main(feeds, items):
+    as_dict = measure(feeds, items, make_dict)
+    as_item = measure(
+        feeds, items, lambda feed, index: FeedItem.from_dict(make_dict(feed, index))
+    )
+    count = feeds * items
+    click.echo(f"{count} items")
+    click.echo(
+        f"dict:     {as_dict / 1024 / 1024:.1f} MB ({as_dict // count} bytes/item)"
+    )
+    click.echo(
+        f"FeedItem: {as_item / 1024 / 1024:.1f} MB ({as_item // count} bytes/item)"
+    )
+    click.echo(f"saved:    {1 - as_item / as_dict:.0%}")
+
+
+if __name__ == "__main__":
+    main()
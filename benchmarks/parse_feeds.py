@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Compare the parsers of redturtle.rssservice on some feeds.
+
+Usage::
+
+    python benchmarks/parse_feeds.py https://www.example.com/rss.xml feed.xml
+
+Feeds can be urls or files. Without arguments, a generated feed is used.
+"""
+from redturtle.rssservice.parsers import fast_parse
+from redturtle.rssservice.session import get_session
+from timeit import timeit
+
+import click
+import feedparser
+import warnings
+
+
+ITEM = """<item>
+<title>News {index}</title>
+<link>http://example.com/news-{index}</link>
+<description><![CDATA[<p>Some <b>news</b> about {index}.</p><img src="http://example.com/{index}.jpg"/>]]></description>
+<pubDate>Thu, 2 Apr 2020 10:44:01 +0200</pubDate>
+<category>news</category>
+<category>example</category>
+<media:thumbnail url="http://example.com/thumb-{index}.jpg"/>
+</item>
+"""
+
+
+def generated_feed(items=100):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/"><channel>'
+        "<title>Example</title><link>http://example.com</link>"
+        + "".join(ITEM.format(index=index) for index in range(items))
+        + "</channel></rss>"
+    ).encode("utf-8")
+
+
+def load(feed):
+    if feed.startswith(("http://", "https://")):
+        return get_session().get(feed, timeout=10).content
+    with open(feed, "rb") as f:
+        return f.read()
+
+
+@click.command()
+@click.option("--repeat", default=20, help="Parses of each feed.")
+@click.argument("feeds", nargs=-1)
+def main(repeat, feeds):
+    warnings.simplefilter("ignore")
+    contents = [(feed, load(feed)) for feed in feeds] or [
+        ("generated", generated_feed())
+    ]
+    for name, content in contents:
+        try:
+            items = len(fast_parse(content)["items"])
+        except Exception as e:
+            click.echo(f"{name}: not supported by the fast parser ({e})")
+            continue
+        slow = timeit(lambda: feedparser.parse(content), number=repeat) / repeat
+        fast = timeit(lambda: fast_parse(content), number=repeat) / repeat
+        click.echo(
+            f"{name}: {len(content)} bytes, {items} items, "
+            f"feedparser {slow * 1000:.1f} ms, fast {fast * 1000:.1f} ms "
+            f"({slow / fast:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
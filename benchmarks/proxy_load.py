@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Load the rssmixer-proxy with concurrent clients and measure its throughput.
+
+Usage::
+
+    python benchmarks/proxy_load.py --server pool --clients 16
+    python benchmarks/proxy_load.py --server single --clients 16
+
+A local origin serves a generated feed (after --origin-delay seconds), and
+the proxy is started on a temporary cache directory. Every client keeps its
+connection alive and requests the cached urls, and one request out of
+--miss-every is for a new url, that the proxy has to fetch from the origin.
+"""
+from parse_feeds import generated_feed
+from redturtle.rssservice.proxycacheserver.main import CachingProxyHandler
+from redturtle.rssservice.proxycacheserver.main import HOT_CACHE
+from redturtle.rssservice.proxycacheserver.main import make_scheduler
+from redturtle.rssservice.proxycacheserver.main import make_server
+from threading import Thread
+
+import click
+import http.server
+import logging
+import requests
+import shutil
+import socketserver
+import tempfile
+import time
+
+
+FEED = generated_feed()
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", len(FEED))
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *args):
+        pass
+
+
+def single_server(host, port, cache_dir, ttl):
+    """The previous server, that handles one connection at a time (and closes
+    it after every response)."""
+
+    class Handler(CachingProxyHandler):
+        protocol_version = "HTTP/1.0"
+        disable_nagle_algorithm = False
+
+    scheduler = make_scheduler(cache_dir, ttl)
+
+    def handler(*args, **kwargs):
+        return Handler(
+            *args, cache_dir=cache_dir, ttl=ttl, scheduler=scheduler, **kwargs
+        )
+
+    socketserver.TCPServer.allow_reuse_address = True
+    return socketserver.TCPServer((host, port), handler)
+
+
+def client(proxy, origin, requests_count, miss_every, index, latencies):
+    session = requests.Session()
+    for number in range(requests_count):
+        if miss_every and number % miss_every == miss_every - 1:
+            url = f"{origin}/miss-{index}-{number}"
+        else:
+            url = f"{origin}/feed-{number % 10}"
+        start = time.perf_counter()
+        session.get(f"{proxy}/{url}", timeout=30).content
+        latencies.append(time.perf_counter() - start)
+    session.close()
+
+
+@click.command()
+@click.option("--server", type=click.Choice(["pool", "single"]), default="pool")
+@click.option("--workers", default=16, help="Threads of the pool server.")
+@click.option("--memory-cache", default=64, help="MB of responses kept in memory.")
+@click.option("--clients", default=16, help="Concurrent clients.")
+@click.option("--requests", "requests_count", default=200, help="For each client.")
+@click.option("--miss-every", default=50, help="One miss every N requests.")
+@click.option("--origin-delay", default=0.2, help="Seconds to reply of the origin.")
+def main(
+    server, workers, memory_cache, clients, requests_count, miss_every, origin_delay
+):
+    logging.getLogger("rssmixer-proxy").setLevel(logging.ERROR)
+    CachingProxyHandler.log_message = lambda *args: None
+    OriginHandler.delay = origin_delay
+    origin_server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+    Thread(target=origin_server.serve_forever, daemon=True).start()
+    origin = "http://127.0.0.1:{}".format(origin_server.server_address[1])
+
+    cache_dir = tempfile.mkdtemp()
+    if server == "pool":
+        httpd = make_server(
+            "127.0.0.1",
+            0,
+            cache_dir,
+            ttl=3600,
+            workers=workers,
+            memory_cache=memory_cache,
+        )
+    else:
+        HOT_CACHE.max_size = memory_cache * 1024 * 1024
+        httpd = single_server("127.0.0.1", 0, cache_dir, ttl=3600)
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    proxy = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    try:
+        # warm up the cache
+        client(proxy, origin, 10, 0, 0, [])
+        latencies = []
+        threads = [
+            Thread(
+                target=client,
+                args=(proxy, origin, requests_count, miss_every, index, latencies),
+            )
+            for index in range(clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        origin_server.shutdown()
+        shutil.rmtree(cache_dir)
+    latencies.sort()
+    click.echo(
+        f"{server}: {len(latencies)} requests in {elapsed:.2f} s, "
+        f"{len(latencies) / elapsed:.0f} req/s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from threading import RLock
+from time import time
+
+
+class BoundedCache(object):
+    """A thread-safe mapping with a LRU eviction policy.
+
+    It is bounded by number of entries and by the total size of the values
+    (measured with the sizeof function), and it drops the entries not read
+    within max_idle seconds. A zero limit means no limit.
+    """
+
+    def __init__(self, max_entries=0, max_size=0, max_idle=0, sizeof=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()  # key: [value, size, last access time]
+        self._size = 0
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._expire()
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            entry[2] = time()
+            self._data.move_to_end(key)
+            # the value could be grown since it was stored
+            self._resize(entry)
+            self._evict()
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            entry = self._data.pop(key)
+            self._size -= entry[1]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def peek(self, key, default=None):
+        """Return the value without counting it as an access."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                return self[key]
+            self._set(key, default)
+            return default
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._size -= entry[1]
+            return entry[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def values(self):
+        with self._lock:
+            return [entry[0] for entry in self._data.values()]
+
+    def items(self):
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._data.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def stats(self):
+        """Return a dict with the usage statistics of the cache."""
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "size": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _set(self, key, value):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+        entry = [value, 0, time()]
+        self._data[key] = entry
+        self._resize(entry)
+        self._expire()
+        self._evict()
+
+    def _resize(self, entry):
+        size = self.sizeof(entry[0])
+        self._size += size - entry[1]
+        entry[1] = size
+
+    def _evict(self):
+        # the most recently used entry is always kept
+        while len(self._data) > 1 and (
+            (self.max_entries and len(self._data) > self.max_entries)
+            or (self.max_size and self._size > self.max_size)
+        ):
+            self._pop_oldest()
+
+    def _expire(self):
+        if not self.max_idle:
+            return
+        limit = time() - self.max_idle
+        # entries are sorted by last access time
+        while self._data and next(iter(self._data.values()))[2] < limit:
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        key, entry = self._data.popitem(last=False)
+        self._size -= entry[1]
+        self.evictions += 1
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from random import uniform
+from threading import Lock
+from time import time
+
+
+class CircuitBreaker(object):
+    """Track the failures of the requests to a host.
+
+    After every failure, requests are not allowed for a delay that doubles at
+    each consecutive failure (with a random jitter, up to max_delay seconds).
+    After threshold consecutive failures the circuit is open: when the delay
+    expires only one request at a time is allowed, to probe the host, and a
+    success closes the circuit again.
+    """
+
+    def __init__(self, threshold=5, base_delay=60, max_delay=3600, probe_timeout=30):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self.failures = 0  # consecutive failures
+        self.retry_time = 0  # requests are not allowed before this time
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        if time() < self.retry_time:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        """Return True if a request to the host can be done now."""
+        with self._lock:
+            now = time()
+            if now < self.retry_time:
+                return False
+            if self.failures >= self.threshold:
+                # the others fail fast while this request probes the host
+                self.retry_time = now + self.probe_timeout
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.retry_time = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            delay = min(self.base_delay * 2 ** (self.failures - 1), self.max_delay)
+            # jitter: hosts failing together are not retried together
+            self.retry_time = time() + uniform(delay / 2, delay)
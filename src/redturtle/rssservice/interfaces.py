@@ -5,7 +5,7 @@ from zope.interface import Interface
 class IRSSMixerFeed(Interface):
     def __init__(url, source, timeout):
         """Initialize the feed with the given url. will not automatically load
-        if timeout defines the time between updates in minutes.
+        if timeout defines the default time between updates in minutes.
         """
 
     def loaded():
@@ -29,6 +29,14 @@ class IRSSMixerFeed(Interface):
     def last_update_time():
         """Return the time the feed was last updated as DateTime object."""
 
+    def interval():
+        """Return the minutes between updates: the ones set in the block, or
+        declared by the feed (ttl, sy:updatePeriod, Cache-Control), or the
+        default ones."""
+
+    def expiration_time():
+        """Return when this feed will need an update, in seconds since epoch."""
+
     def needs_update():
         """return if this feed needs to be updated."""
 
@@ -37,8 +45,42 @@ class IRSSMixerFeed(Interface):
         returns True or False whether it succeeded or not.
         """
 
+    def collapsed_requests():
+        """Return how many updates reused a retrieve already in progress
+        for this feed, instead of doing a new request."""
+
+    def version():
+        """Return the version of the items: it changes every time they change."""
+
     def update_failed():
         """Return if the last update failed or not."""
 
+    def retry_time():
+        """Return when a failed feed can be retrieved again, in seconds since
+        epoch."""
+
     def ok():
         """Is this feed ok to display?"""
+
+
+class IFeedStorage(Interface):
+    """Storage of the retrieved feeds shared between processes, to retrieve
+    and parse a feed only once. Register a utility to use a custom one."""
+
+    def load(url, newer_than=0):
+        """Return the stored state of the feed as a dict (last_update, title,
+        siteurl, etag, last_modified, interval, items_limit, items) if it was updated after
+        newer_than (seconds since epoch), else None."""
+
+    def save(url, state):
+        """Store the state of the feed."""
+
+    def touch(url, last_update):
+        """Mark the stored feed as updated at last_update, with the same items."""
+
+    def acquire(url, timeout):
+        """Try to get the lock to refresh the feed for timeout seconds.
+        Return False if another process holds it."""
+
+    def release(url):
+        """Release the lock to refresh the feed."""
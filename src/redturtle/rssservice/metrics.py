@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from threading import Lock
+
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counters(object):
+    """Thread-safe named counters."""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name):
+        return self._counters.get(name, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class Histogram(object):
+    """Thread-safe histogram of durations, with cumulative buckets like the
+    ones of Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self.clear()
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[index] += 1
+                    break
+
+    def stats(self):
+        """Return the count, the sum and the cumulative count of each bucket
+        (the values less than or equal to its bound)."""
+        with self._lock:
+            buckets = {}
+            total = 0
+            for bound, count in zip(self.buckets, self._counts):
+                total += count
+                buckets[str(bound)] = total
+            buckets["+Inf"] = self._count
+            return {"count": self._count, "sum": self._sum, "buckets": buckets}
+
+    def clear(self):
+        with self._lock:
+            self._counts = [0] * len(self.buckets)
+            self._sum = 0.0
+            self._count = 0
+
+
+def prometheus_text(metrics, prefix="rssmixer"):
+    """Return the metrics in the Prometheus text format.
+
+    metrics is a list of (name, type, help, samples), where samples is a
+    list of (labels dict, value) for counters and gauges, and a Histogram
+    stats dict for histograms.
+    """
+    lines = []
+    for name, metric_type, description, samples in metrics:
+        name = f"{prefix}_{name}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            for bound, count in samples["buckets"].items():
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{name}_sum {samples['sum']}")
+            lines.append(f"{name}_count {samples['count']}")
+            continue
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                key,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in labels.items()
+        )
+        + "}"
+    )
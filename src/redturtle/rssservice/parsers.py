@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""Parsers of the retrieved feeds.
+
+feedparser deals with every kind of feed, but it's slow. The fast parser reads
+only the fields used by the mixer from well-formed RSS 2.0 and Atom feeds, and
+leaves everything else to feedparser.
+"""
+from feedparser import FeedParserDict
+from os import environ
+from xml.etree.ElementTree import ParseError
+from xml.etree.ElementTree import XMLPullParser
+
+import feedparser
+import logging
+
+
+try:
+    from feedparser.datetimes import _parse_date
+    from feedparser.mixin import _FeedParserMixin
+    from feedparser.sanitizer import _sanitize_html
+
+    looks_like_html = _FeedParserMixin.looks_like_html
+except (ImportError, AttributeError):  # pragma: no cover
+    # private api of feedparser: without it, only feedparser is used
+    _sanitize_html = None
+
+
+logger = logging.getLogger(__name__)
+
+# "fast" or "feedparser"
+PARSER = environ.get("RSS_SERVICE_PARSER", "feedparser")
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+DCTERMS = "{http://purl.org/dc/terms/}"
+MEDIA = "{http://search.yahoo.com/mrss/}"
+SY = "{http://purl.org/rss/1.0/modules/syndication/}"
+
+
+class UnsupportedFeed(Exception):
+    """The feed can't be parsed by the fast parser."""
+
+
+def parse_feed(content, truncated=False):
+    """Parse the content of a feed with the configured parser.
+
+    truncated means that the content was cut on purpose after an item: the
+    fast parser accepts it, and feedparser reports it as bozo.
+    """
+    if PARSER == "fast" and _sanitize_html is not None:
+        try:
+            return fast_parse(content, truncated=truncated)
+        except (UnsupportedFeed, ParseError, LookupError, ValueError) as e:
+            logger.debug("Parse with feedparser: %s", e)
+    return feedparser.parse(content)
+
+
+def fast_parse(content, truncated=False):
+    """Parse a RSS 2.0 or Atom feed, with the same keys of feedparser for the
+    fields used by the mixer.
+
+    Raise UnsupportedFeed or ParseError if the feed is of another format or
+    not well-formed.
+    """
+    parser = XMLPullParser(events=("start", "end"))
+    parser.feed(content)
+    try:
+        parser.close()
+    except ParseError:
+        if not truncated:
+            raise
+    root = None
+    for event, element in parser.read_events():
+        if event == "start":
+            root = element
+            break
+    if root is None:
+        raise UnsupportedFeed("empty document")
+    if root.tag == "rss":
+        channel = root.find("channel")
+        if channel is None:
+            raise UnsupportedFeed("missing channel")
+        return FeedParserDict(
+            bozo=0,
+            version="rss20",
+            feed=rss_feed(channel),
+            entries=[rss_entry(item) for item in channel.iterfind("item")],
+        )
+    if root.tag == f"{ATOM}feed":
+        return FeedParserDict(
+            bozo=0,
+            version="atom10",
+            feed=atom_feed(root),
+            entries=[atom_entry(entry) for entry in root.iterfind(f"{ATOM}entry")],
+        )
+    raise UnsupportedFeed(f"unknown format {root.tag}")
+
+
+def rss_feed(channel):
+    feed = FeedParserDict(
+        title=get_title(channel),
+        link=get_text(channel, "link"),
+    )
+    set_text(feed, "ttl", channel, "ttl")
+    set_text(feed, "sy_updateperiod", channel, f"{SY}updatePeriod")
+    set_text(feed, "sy_updatefrequency", channel, f"{SY}updateFrequency")
+    return feed
+
+
+def rss_entry(item):
+    entry = FeedParserDict(title=get_title(item))
+    set_text(entry, "link", item, "link")
+    description = item.find("description")
+    if description is not None:
+        entry["summary"] = sanitize(get_text(description))
+    set_date(entry, "published", item, "pubDate", f"{DCTERMS}issued")
+    set_date(
+        entry, "updated", item, f"{ATOM}updated", f"{DC}date", f"{DCTERMS}modified"
+    )
+    tags = [
+        FeedParserDict(term=get_text(category))
+        for category in item.iterfind("category")
+    ]
+    if tags:
+        entry["tags"] = tags
+    links = [
+        FeedParserDict(
+            rel="enclosure",
+            type=enclosure.get("type", ""),
+            href=enclosure.get("url", ""),
+        )
+        for enclosure in item.iterfind("enclosure")
+    ]
+    if entry.get("link"):
+        links.insert(
+            0, FeedParserDict(rel="alternate", type="text/html", href=entry["link"])
+        )
+    if links:
+        entry["links"] = links
+    set_media(entry, item)
+    return entry
+
+
+def atom_feed(root):
+    feed = FeedParserDict(
+        title=get_atom_text(root.find(f"{ATOM}title")),
+        link=get_atom_link(root),
+    )
+    return feed
+
+
+def atom_entry(element):
+    entry = FeedParserDict(title=get_atom_text(element.find(f"{ATOM}title")))
+    link = get_atom_link(element)
+    if link:
+        entry["link"] = link
+    summary = element.find(f"{ATOM}summary")
+    if summary is None:
+        summary = element.find(f"{ATOM}content")
+    if summary is not None:
+        entry["summary"] = get_atom_text(summary)
+    set_date(entry, "published", element, f"{ATOM}published")
+    set_date(entry, "updated", element, f"{ATOM}updated")
+    tags = [
+        FeedParserDict(term=category.get("term"))
+        for category in element.iterfind(f"{ATOM}category")
+    ]
+    if tags:
+        entry["tags"] = tags
+    links = [
+        FeedParserDict(
+            rel=link.get("rel", "alternate"),
+            type=link.get("type", ""),
+            href=link.get("href", ""),
+        )
+        for link in element.iterfind(f"{ATOM}link")
+    ]
+    if links:
+        entry["links"] = links
+    set_media(entry, element)
+    return entry
+
+
+def get_text(element, tag=None):
+    if tag is not None:
+        element = element.find(tag)
+        if element is None:
+            return ""
+    return (element.text or "").strip()
+
+
+def get_title(element):
+    # titles are plain text, unless they look like html
+    title = get_text(element, "title")
+    if looks_like_html(title):
+        return sanitize(title)
+    return title
+
+
+def set_text(data, key, element, *tags):
+    """Set in data the text of the first of tags found in element."""
+    for tag in tags:
+        child = element.find(tag)
+        if child is not None and child.text:
+            data[key] = child.text.strip()
+            return
+
+
+def set_date(data, key, element, *tags):
+    """Set in data the first of tags found in element, and the time tuple
+    parsed from it."""
+    set_text(data, key, element, *tags)
+    if key in data:
+        data[f"{key}_parsed"] = _parse_date(data[key])
+
+
+def get_atom_text(element):
+    if element is None:
+        return ""
+    content_type = element.get("type", "text")
+    if content_type == "text":
+        return get_text(element)
+    if content_type == "html":
+        return sanitize(get_text(element))
+    # xhtml, or other media types
+    raise UnsupportedFeed(f"content of type {content_type}")
+
+
+def get_atom_link(element):
+    for link in element.iterfind(f"{ATOM}link"):
+        if link.get("rel", "alternate") == "alternate":
+            return link.get("href", "")
+    return ""
+
+
+def set_media(entry, element):
+    thumbnails = [
+        FeedParserDict(url=thumbnail.get("url", ""))
+        for thumbnail in element.iter(f"{MEDIA}thumbnail")
+    ]
+    if thumbnails:
+        entry["media_thumbnail"] = thumbnails
+    contents = [
+        FeedParserDict(url=content.get("url", ""), medium=content.get("medium", ""))
+        for content in element.iter(f"{MEDIA}content")
+    ]
+    if contents:
+        entry["media_content"] = contents
+
+
+def sanitize(html):
+    if "<" not in html:
+        return html
+    return _sanitize_html(html, "utf-8", "text/html")
@@ -3,26 +3,48 @@ This code implements a caching proxy server that stores and serves web content.
 
 Key Components:
 * Creates unique filenames for cached content using MD5 hashing
-* Stores both the content and metadata (URL information) in separate files
+* Stores in each file a line of JSON metadata (url, headers, status and size)
+  followed by the raw body of the response, written to a temporary file and
+  renamed, so readers never see a half-written file
 * Background refresh content periodically
 
 The Proxy Server:
 
 * Listens for incoming requests (be awere to protect connection or leave the server listen only on localhost)
 * Checks if requested content is in cache
-* If found, serves from cache
+* If found, serves from cache (the most requested responses are kept in
+  memory, up to --memory-cache MB, the others are sent from the file with
+  sendfile)
 * If not found, fetches it, saves it, then serves it
+* Passes ETag and Last-Modified of the origin to the clients, and replies
+  304 to their conditional requests that match them
+
+Requests are served by a bounded pool of threads (--workers), so a slow
+fetch does not block the clients of cached urls, and connections are kept
+alive (HTTP/1.1) up to --keepalive-timeout seconds of inactivity. An idle
+connection does not hold a thread: it waits for the next request in a
+selector.
 
 Background Refresh:
 
-* Automatically updates cached content periodically
-* Runs in separate threads to not block the main server
-* Time between updates is configurable (TTL - Time To Live)
+* Automatically updates cached content periodically, with conditional
+  requests (If-None-Match / If-Modified-Since) when the origin sent ETag or
+  Last-Modified: a 304 reply keeps the cached content
+* Rewrites the cache file only if the content changed
+* A scheduler keeps one pending refresh for each url, ordered by time, and
+  runs them in a pool of --refresh-workers threads, not in the server ones
+* Time between updates is configurable (TTL - Time To Live), with a random
+  jitter up to 10% of it to spread the refreshes
+* GET /_status returns the number of pending refreshes and the statistics of
+  the memory cache
 
 Command Line Interface : Uses Click library to accept parameters like:
 
 Host address (default: 127.0.0.1)
 Port number (default: 8080)
+Number of threads serving requests (default: 16)
+MB of responses kept in memory (default: 64)
+Number of threads refreshing the cache (default: 4)
 Cache directory location (default: ./var/cache)
 TTL for cache refresh (default: 3600 seconds)
 
@@ -52,6 +74,16 @@ This is particularly useful for:
 * Saving bandwidth by not repeatedly downloading the same content
 """
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+from redturtle.rssservice.cache import BoundedCache
+from redturtle.rssservice.scheduler import RefreshScheduler
+from redturtle.rssservice.session import etag_matches
+from redturtle.rssservice.session import get_session
+from redturtle.rssservice.session import read_content
+
 import click
 import hashlib
 import http.server
@@ -59,8 +91,9 @@ import json
 import logging
 import os
 import re
-import requests
-import socketserver
+import selectors
+import socket
+import tempfile
 import threading
 import time
 
@@ -68,6 +101,23 @@ import time
 # this is not thtread-safe, but we don't care about it !
 LAST_ACCESS_TIMES = {}
 MAX_TTL_IN_CACHE = 7 * 24 * 3600  # 1 week
+# response headers passed to the clients
+RESPONSE_HEADERS = ("content-type", "cache-control", "etag", "last-modified")
+# response headers of a 304 reply
+NOT_MODIFIED_HEADERS = ("cache-control", "etag", "last-modified")
+# request headers of the clients not sent to the origin: the proxy replies to
+# the conditional requests itself
+CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+
+# responses ready to send, read from the cache files: cache file -> Response
+# (the size limit is set by make_server)
+HOT_CACHE = BoundedCache(sizeof=lambda response: len(response.body))
+# cache file -> number of writes, to not keep in memory a response read
+# from a file that was rewritten in the meantime
+FILE_VERSIONS = {}
+FILE_VERSIONS_LOCK = threading.Lock()
+
+Response = namedtuple("Response", ("status_code", "headers", "body"))
 
 logger = logging.getLogger("rssmixer-proxy")
 logger.setLevel(logging.INFO)
@@ -82,27 +132,144 @@ logger.addHandler(stream_handler)
 # Function to calculate cache file path based on URL
 def cache_path(url, cache_dir):
     hash_url = hashlib.md5(url.encode("utf-8")).hexdigest()
-    return os.path.join(cache_dir, f"{hash_url}.json")
+    return os.path.join(cache_dir, f"{hash_url}.cache")
+
+
+def make_headers(response_headers, size):
+    """Return the headers to send to the clients."""
+    headers = [
+        (header, value)
+        for header, value in response_headers.items()
+        if header.lower() in RESPONSE_HEADERS
+    ]
+    headers.append(("Content-Length", str(size)))
+    return tuple(headers)
+
+
+def make_response(cache_content):
+    """Return the Response to send to the clients for a cached content."""
+    body = cache_content["body"]
+    headers = make_headers(cache_content["response_headers"], len(body))
+    return Response(cache_content["status_code"], headers, body)
+
+
+def content_hash(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def is_unchanged(metadata, cache_content):
+    """Check if the content would be sent to the clients as the one of the
+    cache file with these metadata."""
+    body = cache_content["body"]
+    return (
+        metadata.get("status_code") == cache_content["status_code"]
+        and metadata.get("hash") == content_hash(body)
+        and make_headers(metadata["response_headers"], metadata["size"])
+        == make_headers(cache_content["response_headers"], len(body))
+    )
+
+
+def get_validators(response_headers):
+    """Return the headers of a conditional request to revalidate a response
+    with these headers."""
+    response_headers = {
+        header.lower(): value for header, value in response_headers.items()
+    }
+    validators = {}
+    if response_headers.get("etag"):
+        validators["If-None-Match"] = response_headers["etag"]
+    if response_headers.get("last-modified"):
+        validators["If-Modified-Since"] = response_headers["last-modified"]
+    return validators
+
+
+def write_cache_file(cache_file, cache_content):
+    """Write the metadata and the body of the content in the cache file."""
+    metadata = {key: value for key, value in cache_content.items() if key != "body"}
+    metadata["size"] = len(cache_content["body"])
+    metadata["hash"] = content_hash(cache_content["body"])
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # json.dumps escapes newlines: the metadata are on the first line
+            f.write(json.dumps(metadata).encode("utf-8") + b"\n")
+            f.write(cache_content["body"])
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+    invalidate(cache_file)
+
+
+def read_metadata(f):
+    """Read the metadata of a cache file opened in binary mode, leaving the
+    file at the start of the body."""
+    return json.loads(f.readline())
+
+
+def invalidate(cache_file):
+    """Drop from memory the response of a cache file written or removed."""
+    with FILE_VERSIONS_LOCK:
+        FILE_VERSIONS[cache_file] = FILE_VERSIONS.get(cache_file, 0) + 1
+        HOT_CACHE.pop(cache_file)
+
+
+def cache_response(cache_file, response, version):
+    """Keep in memory the response read from the cache file, unless the file
+    was written again since version."""
+    with FILE_VERSIONS_LOCK:
+        if FILE_VERSIONS.get(cache_file, 0) == version:
+            HOT_CACHE[cache_file] = response
+
+
+def load_cache_content(cache_file):
+    with open(cache_file, "rb") as f:
+        cache_content = read_metadata(f)
+        cache_content["body"] = f.read(cache_content["size"])
+    return cache_content
 
 
-def load_json(cache_file):
+def load_metadata(cache_file):
     try:
         if os.path.exists(cache_file):
-            with open(cache_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(cache_file, "rb") as f:
+                return read_metadata(f)
     except Exception:
-        return {}
+        pass
+    return {}
+
+
+def convert_legacy_file(legacy_file):
+    """Convert a cache file of the previous format (a JSON document with the
+    body as text) and return its url."""
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        cache_content = json.load(f)
+    url = cache_content.get("url", "")
+    if url:
+        # the body was sent to the clients encoded in utf-8
+        cache_content["body"] = cache_content["body"].encode("utf-8")
+        write_cache_file(cache_path(url, os.path.dirname(legacy_file)), cache_content)
+    os.remove(legacy_file)
+    return url
 
 
 def fetch_and_cache(url, cache_dir, client_headers=None, timeout=(1, 10)):
     cache_file = cache_path(url, cache_dir)
+    metadata = load_metadata(cache_file)
+    validators = {}
     try:
         # Send the request to the server
         if client_headers is None:
-            data = load_json(cache_file)
-            headers = data.get("request_headers", {})
+            headers = metadata.get("request_headers", {})
+            if metadata.get("status_code") == 200:
+                # revalidate the cached response
+                validators = get_validators(metadata["response_headers"])
         else:
-            headers = client_headers
+            headers = {
+                header: value
+                for header, value in client_headers.items()
+                if header.lower() not in CONDITIONAL_HEADERS
+            }
         if "User-Agent" not in headers:
             headers["User-Agent"] = "RSSMixerProxy/1.0"
         if "Host" in headers:
@@ -110,7 +277,17 @@ def fetch_and_cache(url, cache_dir, client_headers=None, timeout=(1, 10)):
         # Validate the URL
         if not re.match(r"^https?:\/\/", url):
             raise ValueError(f"Invalid URL path: {url}")
-        response = requests.get(url, headers=headers, timeout=timeout)
+        response = get_session().get(
+            url, headers=dict(headers, **validators), timeout=timeout, stream=True
+        )
+        if response.status_code == 304 and validators:
+            # the cached response is still fresh
+            response.close()
+            logger.info("Not modified: %s", url)
+            return load_cache_content(cache_file)
+        # Download at most RSS_SERVICE_MAX_BYTES within
+        # RSS_SERVICE_DOWNLOAD_DEADLINE seconds
+        body, _ = read_content(response)
         # Store the response in the cache
         if response.status_code == 200:
             cache_content = {
@@ -118,24 +295,24 @@ def fetch_and_cache(url, cache_dir, client_headers=None, timeout=(1, 10)):
                 "request_headers": headers,
                 "response_headers": dict(response.headers),
                 "status_code": response.status_code,
-                "body": response.text,
+                "body": body,
             }
-            # TODO: update file only if changed ?
-            with open(cache_file, "w", encoding="utf-8") as f:
-                json.dump(cache_content, f, indent=2)
-            logger.info("Cached %s: %s in %s", response.status_code, url, cache_dir)
+            if metadata and is_unchanged(metadata, cache_content):
+                logger.info("Unchanged: %s", url)
+            else:
+                write_cache_file(cache_file, cache_content)
+                logger.info("Cached %s: %s in %s", response.status_code, url, cache_dir)
         else:
-            logger.error("Failed to fetch $s: %s", url, response.status_code)
+            logger.error("Failed to fetch %s: %s", url, response.status_code)
             cache_content = {
                 "url": url,
                 "request_headers": headers,
                 "response_headers": dict(response.headers),
                 "status_code": response.status_code,
-                "body": response.text,
+                "body": body,
             }
             if not os.path.exists(cache_file):
-                with open(cache_file, "w", encoding="utf-8") as f:
-                    json.dump(cache_content, f, indent=2)
+                write_cache_file(cache_file, cache_content)
                 logger.info(
                     "Cached error %s: %s in %s", response.status_code, url, cache_dir
                 )
@@ -146,98 +323,351 @@ def fetch_and_cache(url, cache_dir, client_headers=None, timeout=(1, 10)):
             "request_headers": headers,
             "response_headers": {},
             "status_code": 500,
-            "body": str(e),
+            "body": str(e).encode("utf-8"),
         }
         if not os.path.exists(cache_file):
-            with open(cache_file, "w", encoding="utf-8") as f:
-                json.dump(cache_content, f, indent=2)
+            write_cache_file(cache_file, cache_content)
             logger.info("Cached error: %s in %s", url, cache_dir)
     return cache_content
 
 
-# Background thread to refresh cache
+# Background refresh of the cache, run by the scheduler
 def refresh_cache(url, cache_dir, ttl):
-    logger.info(f"Refresh cache for {url} every {ttl} seconds")
-    while True:
-        time.sleep(ttl)
-        if url not in LAST_ACCESS_TIMES:
-            LAST_ACCESS_TIMES[url] = time.time()
-        else:
-            if LAST_ACCESS_TIMES[url] + MAX_TTL_IN_CACHE < time.time():
-                cache_file = cache_path(url, cache_dir)
-                if os.path.exists(cache_file):
-                    os.remove(cache_file)
-                logger.warning("Remove %s from cached files", url)
-                return
-        logger.info("Refresh cache for %s", url)
-        fetch_and_cache(url, cache_dir)
-
-
-# Load URLs to cache from existing .url files
+    """Refresh the cache of the url, and return when to do it again (None if
+    it's not requested since MAX_TTL_IN_CACHE)."""
+    last_access = LAST_ACCESS_TIMES.setdefault(url, time.time())
+    if last_access + MAX_TTL_IN_CACHE < time.time():
+        cache_file = cache_path(url, cache_dir)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        invalidate(cache_file)
+        del LAST_ACCESS_TIMES[url]
+        logger.warning("Remove %s from cached files", url)
+        return None
+    logger.info("Refresh cache for %s", url)
+    fetch_and_cache(url, cache_dir)
+    return time.time() + ttl
+
+
+def make_scheduler(cache_dir, ttl, workers=4):
+    """Return the scheduler of the refreshes of the cached urls."""
+    return RefreshScheduler(
+        job=partial(refresh_cache, cache_dir=cache_dir, ttl=ttl),
+        max_workers=workers,
+        jitter=ttl // 10,
+        name="rssmixer-proxy-refresh",
+    )
+
+
+# Load URLs to cache from existing cache files
 def load_urls_from_cache(cache_dir):
     urls = []
     for file in os.listdir(cache_dir):
-        if file.endswith(".json"):
-            hash_file = os.path.join(cache_dir, file)
-            try:
+        hash_file = os.path.join(cache_dir, file)
+        try:
+            if file.endswith(".tmp"):
+                # left by an interrupted write
+                os.remove(hash_file)
+                continue
+            if file.endswith(".json"):
+                url = convert_legacy_file(hash_file)
+                logger.info("Converted %s to the new format", hash_file)
+            elif file.endswith(".cache"):
                 # Extract original URL from the cached file
-                data = json.load(open(hash_file, "r", encoding="utf-8"))
-                url = data.get("url", "")
-                if url:
-                    logger.info("Load: %s from cache %s", url, hash_file)
-                    urls.append(url)
-            except Exception as e:
-                logger.info("Error reading cached file %s: %s", file, e)
+                url = load_metadata(hash_file).get("url", "")
+            else:
+                continue
+            if url:
+                logger.info("Load: %s from cache %s", url, hash_file)
+                urls.append(url)
+        except Exception as e:
+            logger.info("Error reading cached file %s: %s", file, e)
     return urls
 
 
 # HTTP proxy handler
 class CachingProxyHandler(http.server.BaseHTTPRequestHandler):
-    def __init__(self, *args, cache_dir=None, ttl=None, **kwargs):
+    # keep connections alive: every response has a Content-Length
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: send them without waiting
+    # for the ack of the client
+    disable_nagle_algorithm = True
+    # seconds to wait for the data of a request
+    timeout = 15
+
+    def __init__(
+        self, *args, cache_dir=None, ttl=None, scheduler=None, timeout=None, **kwargs
+    ):
         self.cache_dir = cache_dir
         self.ttl = ttl
+        self.scheduler = scheduler
+        if timeout is not None:
+            self.timeout = timeout
         super().__init__(*args, **kwargs)
 
+    def handle(self):
+        if not isinstance(self.server, PoolHTTPServer):
+            return super().handle()
+        # handle only the requests already sent: the server waits for the
+        # next ones without keeping a worker busy
+        self.handle_one_request()
+        while not self.close_connection and self.has_pending_data():
+            self.handle_one_request()
+
+    def has_pending_data(self):
+        """Check, without waiting, if the client has sent more data."""
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(timeout)
+
     def do_GET(self):
+        if self.path == "/_status":
+            return self.send_status()
 
-        url = self.path.lstrip("/").replace("\n").replace("\r")
+        url = self.path.lstrip("/").replace("\n", "").replace("\r", "")
         LAST_ACCESS_TIMES[url] = time.time()
         cache_file = cache_path(url, self.cache_dir)
 
         # Check if the page is already cached
-        if os.path.exists(cache_file):
+        if cache_file in HOT_CACHE or os.path.exists(cache_file):
             logger.info("Serving from cache: %s", url)
-            with open(cache_file, "r", encoding="utf-8") as f:
-                cache_content = json.load(f)
+            self.send_cached(cache_file)
         else:
             logger.info("Fetching and caching: %s", url)
             client_headers = dict(self.headers)
             cache_content = fetch_and_cache(url, self.cache_dir, client_headers)
-            threading.Thread(
-                target=refresh_cache, args=(url, self.cache_dir, self.ttl), daemon=True
-            ).start()
-
-        # Send response
-        self.send_response(cache_content["status_code"])
-        for header, value in cache_content["response_headers"].items():
-            if header.lower() in ("set-cookie", "content-length"):
-                continue
-            if header.lower() in ("content-type", "cache-control"):
-                self.send_header(header, value)
-                continue
-            # logger.info("skip header", header, value)
-        self.send_header("Content-Length", len(cache_content["body"].encode("utf-8")))
+            # concurrent misses of the url keep a single pending refresh
+            self.scheduler.schedule(url, time.time() + self.ttl)
+            self.send(make_response(cache_content))
+
+    def send_cached(self, cache_file):
+        """Send the response of a cache file, from memory if possible."""
+        response = HOT_CACHE.get(cache_file)
+        if response is not None:
+            return self.send(response)
+        version = FILE_VERSIONS.get(cache_file, 0)
+        with open(cache_file, "rb") as f:
+            metadata = read_metadata(f)
+            size = metadata["size"]
+            headers = make_headers(metadata["response_headers"], size)
+            # a single response can't take more than a part of the memory cache
+            if size <= HOT_CACHE.max_size // 16:
+                response = Response(metadata["status_code"], headers, f.read(size))
+                cache_response(cache_file, response, version)
+                return self.send(response)
+            if self.send_head(metadata["status_code"], headers):
+                # zero-copy from the file to the socket
+                self.connection.sendfile(f, f.tell(), size)
+
+    def send_head(self, status_code, headers):
+        """Send the status and the headers of the response, or a 304 reply to
+        a matching conditional request. Return True if the body is to send."""
+        if status_code == 200 and self.is_not_modified(headers):
+            self.send_response(304)
+            for header, value in headers:
+                if header.lower() in NOT_MODIFIED_HEADERS:
+                    self.send_header(header, value)
+            self.end_headers()
+            return False
+        self.send_response(status_code)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        return True
+
+    def send(self, response):
+        if self.send_head(response.status_code, response.headers):
+            self.wfile.write(response.body)
+
+    def is_not_modified(self, headers):
+        """Check if the conditional request of the client matches the ETag or
+        the Last-Modified of a response with these headers."""
+        headers = {header.lower(): value for header, value in headers}
+        etag = headers.get("etag")
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            if not etag:
+                return False
+            if etag.startswith("W/"):
+                etag = etag[2:]
+            return etag_matches(if_none_match, etag)
+        last_modified = headers.get("last-modified")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if not last_modified or not if_modified_since:
+            return False
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            )
+        except (TypeError, ValueError):
+            return False
+
+    def send_status(self):
+        body = json.dumps(
+            {
+                "refresh_queue": self.scheduler.queue_depth,
+                "memory_cache": HOT_CACHE.stats(),
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(cache_content["body"].encode("utf-8"))
+        self.wfile.write(body)
+
+
+class PoolHTTPServer(http.server.HTTPServer):
+    """HTTP server that handles the requests in a bounded pool of threads.
+
+    A worker is busy only while it handles the requests sent on a connection:
+    idle connections kept alive wait in a selector, and go back to the pool
+    when the client sends data. They are closed after keepalive_timeout
+    seconds of inactivity. Requests beyond the number of workers wait in the
+    pool queue.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(
+        self, *args, workers=16, scheduler=None, keepalive_timeout=15, **kwargs
+    ):
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="rssmixer-proxy"
+        )
+        self.scheduler = scheduler
+        self.keepalive_timeout = keepalive_timeout
+        self.closed = False
+        # idle connections: socket -> (client address, idle since)
+        self.idle = selectors.DefaultSelector()
+        self.idle_lock = threading.Lock()
+        # wakes up the selector when a connection is added
+        self._wakeup, self._wakeup_sender = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self.idle.register(self._wakeup, selectors.EVENT_READ)
+        super().__init__(*args, **kwargs)
+        self._idle_thread = threading.Thread(
+            target=self.watch_idle, name="rssmixer-proxy-idle", daemon=True
+        )
+        self._idle_thread.start()
 
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        handler = None
+        try:
+            # not if queued before the server was closed
+            if not self.closed:
+                handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+        if handler is None or handler.close_connection:
+            self.shutdown_request(request)
+        else:
+            self.park(request, client_address)
+
+    def park(self, request, client_address):
+        """Wait for the next request of a connection kept alive."""
+        with self.idle_lock:
+            if self.closed:
+                self.shutdown_request(request)
+                return
+            self.idle.register(
+                request, selectors.EVENT_READ, (client_address, time.monotonic())
+            )
+        self._wakeup_sender.send(b"\0")
+
+    def watch_idle(self):
+        """Give back to the pool the idle connections with new data, and close
+        the ones idle for too long."""
+        while True:
+            events = self.idle.select(timeout=1)
+            with self.idle_lock:
+                if self.closed:
+                    return
+                for key, mask in events:
+                    if key.fileobj is self._wakeup:
+                        try:
+                            self._wakeup.recv(4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    self.idle.unregister(key.fileobj)
+                    self.pool.submit(
+                        self.process_request_thread, key.fileobj, key.data[0]
+                    )
+                expired = time.monotonic() - self.keepalive_timeout
+                for key in list(self.idle.get_map().values()):
+                    if key.fileobj is not self._wakeup and key.data[1] < expired:
+                        self.idle.unregister(key.fileobj)
+                        self.shutdown_request(key.fileobj)
+
+    def server_close(self):
+        super().server_close()
+        with self.idle_lock:
+            if self.closed:
+                return
+            self.closed = True
+            for key in list(self.idle.get_map().values()):
+                if key.fileobj is not self._wakeup:
+                    self.shutdown_request(key.fileobj)
+        self._wakeup_sender.send(b"\0")
+        self._idle_thread.join()
+        self.idle.close()
+        self._wakeup.close()
+        self._wakeup_sender.close()
+        # cancel_futures needs Python 3.9: the queued connections are closed
+        # by process_request_thread
+        self.pool.shutdown(wait=False)
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+
+def make_server(
+    host,
+    port,
+    cache_dir,
+    ttl,
+    workers=16,
+    keepalive_timeout=15,
+    memory_cache=64,
+    refresh_workers=4,
+):
+    # MB of responses kept in memory (0 means none)
+    HOT_CACHE.max_size = memory_cache * 1024 * 1024
+    HOT_CACHE.clear()
+    scheduler = make_scheduler(cache_dir, ttl, refresh_workers)
 
-# Start the server
-def start_server(host, port, cache_dir, ttl):
     def handler(*args, **kwargs):
-        return CachingProxyHandler(*args, cache_dir=cache_dir, ttl=ttl, **kwargs)
+        return CachingProxyHandler(
+            *args,
+            cache_dir=cache_dir,
+            ttl=ttl,
+            scheduler=scheduler,
+            timeout=keepalive_timeout,
+            **kwargs,
+        )
+
+    return PoolHTTPServer(
+        (host, port),
+        handler,
+        workers=workers,
+        scheduler=scheduler,
+        keepalive_timeout=keepalive_timeout,
+    )
 
-    socketserver.TCPServer.allow_reuse_address = True
-    with socketserver.TCPServer((host, port), handler) as httpd:
+
+# Start the server
+def start_server(host, port, cache_dir, ttl, **options):
+    with make_server(host, port, cache_dir, ttl, **options) as httpd:
+        # Load URLs from cache directory and schedule their refresh
+        for url in load_urls_from_cache(cache_dir):
+            httpd.scheduler.schedule(url, time.time() + ttl)
         try:
             logger.info("Serving on http://%s:%s", host, port)
             httpd.serve_forever()
@@ -255,20 +685,43 @@ def start_server(host, port, cache_dir, ttl):
     "--cache-dir", default="./var/cache", help="Directory to store cached files."
 )
 @click.option("--ttl", default=3600, help="")
-def main(host, port, cache_dir, ttl):
+@click.option("--workers", default=16, help="Number of threads serving requests.")
+@click.option(
+    "--keepalive-timeout",
+    default=15,
+    help="Seconds an idle connection is kept alive.",
+)
+@click.option(
+    "--memory-cache",
+    default=64,
+    help="MB of the most requested responses kept in memory.",
+)
+@click.option("--refresh-workers", default=4, help="Number of threads refreshing.")
+def main(
+    host,
+    port,
+    cache_dir,
+    ttl,
+    workers,
+    keepalive_timeout,
+    memory_cache,
+    refresh_workers,
+):
     # Create cache directory if it doesn't exist
     os.makedirs(cache_dir, exist_ok=True)
 
-    # Load URLs from cache directory and start refresh threads
-    cached_urls = load_urls_from_cache(cache_dir)
     try:
-        for url in cached_urls:
-            threading.Thread(
-                target=refresh_cache, args=(url, cache_dir, ttl), daemon=True
-            ).start()
-
         # Start the proxy server
-        start_server(host, port, cache_dir, ttl)
+        start_server(
+            host,
+            port,
+            cache_dir,
+            ttl,
+            workers=workers,
+            keepalive_timeout=keepalive_timeout,
+            memory_cache=memory_cache,
+            refresh_workers=refresh_workers,
+        )
     except KeyboardInterrupt:
         logger.info("Server stopped.")
     finally:
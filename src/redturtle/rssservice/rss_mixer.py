@@ -1,47 +1,262 @@
 # -*- coding: utf-8 -*-
+from calendar import timegm
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from copy import deepcopy
+from datetime import datetime
+from datetime import timezone
 from DateTime import DateTime
-from DateTime.interfaces import SyntaxError
+from DateTime.interfaces import DateTimeError
+from email.utils import formatdate
+from functools import lru_cache
+from html import escape
+from html import unescape
+from itertools import chain
+from itertools import count
+from itertools import dropwhile
+from itertools import islice
+from itertools import takewhile
+from operator import attrgetter
+from operator import itemgetter
 from os import environ
 from plone.dexterity.utils import iterSchemata
-from plone.restapi.serializer.converters import json_compatible
 from plone.restapi.serializer.utils import uid_to_url
 from plone.restapi.services import Service
 from redturtle.rssservice import _
+from redturtle.rssservice.cache import BoundedCache
+from redturtle.rssservice.circuitbreaker import CircuitBreaker
 from redturtle.rssservice.interfaces import IRSSMixerFeed
+from redturtle.rssservice.metrics import Counters
+from redturtle.rssservice.metrics import Histogram
+from redturtle.rssservice.parsers import parse_feed
+from redturtle.rssservice.scheduler import RefreshScheduler
+from redturtle.rssservice.session import etag_matches
+from redturtle.rssservice.session import get_session
+from redturtle.rssservice.session import read_content
+from redturtle.rssservice.storage import get_feed_storage
 from requests.exceptions import RequestException
 from requests.exceptions import Timeout
+from sys import intern
+from threading import Lock
+from time import sleep
 from time import time
+from urllib.parse import urlparse
+from xml.parsers.expat import ExpatError
+from xml.parsers.expat import ParserCreate
 from zExceptions import BadRequest
 from zExceptions import NotFound
+from ZODB.utils import z64
 from zope.i18n import translate
 from zope.interface import implementer
 from zope.schema import getFields
 
 import feedparser
+import hashlib
+import heapq
 import json
 import logging
-import requests
+import re
 
 
 logger = logging.getLogger(__name__)
 
 
+# returned when the feed did not change since the last retrieve
+NOT_MODIFIED = object()
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+TAG_RE = re.compile(r"<[^>]*>")
+SPACES_RE = re.compile(r"\s+")
+
+# local names of the dates of the items of RSS and Atom feeds (see parsers)
+UPDATED_TAGS = ("updated", "date", "modified")
+PUBLISHED_TAGS = ("pubDate", "published", "issued")
+
+# minutes of the periods of sy:updatePeriod
+SY_UPDATE_PERIODS = {
+    "hourly": 60,
+    "daily": 60 * 24,
+    "weekly": 60 * 24 * 7,
+    "monthly": 60 * 24 * 30,
+    "yearly": 60 * 24 * 365,
+}
+
 # Accept these bozo_exceptions encountered by feedparser when parsing
 # the feed:
 ACCEPTED_FEEDPARSER_EXCEPTIONS = (feedparser.CharacterEncodingOverride,)
 
-# store the feeds here (which means in RAM)
-FEED_DATA = {}  # url: ({date, title, url, itemlist})
-
 REQUESTS_TIMEOUT = int(environ.get("RSS_SERVICE_TIMEOUT", "5")) or 5
 REQUESTS_USER_AGENT = environ.get("RSS_USER_AGENT")
 RSSMIXER_HTTP_PROXY = environ.get("RSSMIXER_PROXY", "")
+MAX_WORKERS = int(environ.get("RSS_SERVICE_MAX_WORKERS", "8")) or 8
+# minutes between updates of a feed, if not set in the block or by the feed
+REFRESH_INTERVAL = int(environ.get("RSS_SERVICE_REFRESH_INTERVAL", "100")) or 100
+# bounds of the intervals declared by the feeds
+MIN_REFRESH_INTERVAL = int(environ.get("RSS_SERVICE_MIN_REFRESH_INTERVAL", "5"))
+MAX_REFRESH_INTERVAL = int(environ.get("RSS_SERVICE_MAX_REFRESH_INTERVAL", "1440"))
+# minutes an expired feed can be served while it's refreshed in background
+# (0 disables stale-while-revalidate)
+MAX_STALENESS = int(environ.get("RSS_SERVICE_STALE_WHILE_REVALIDATE", "0"))
+CACHE_MAX_FEEDS = int(environ.get("RSS_SERVICE_CACHE_MAX_FEEDS", "1000"))
+CACHE_MAX_SIZE = int(environ.get("RSS_SERVICE_CACHE_MAX_SIZE", "100"))  # MB
+CACHE_MAX_IDLE = int(environ.get("RSS_SERVICE_CACHE_MAX_IDLE", "1440"))  # minutes
+RESPONSE_CACHE_MAX_ENTRIES = int(environ.get("RSS_SERVICE_RESPONSE_CACHE_SIZE", "500"))
+BLOCKS_INDEX_MAX_ENTRIES = int(environ.get("RSS_SERVICE_BLOCKS_INDEX_SIZE", "1000"))
+DATES_CACHE_SIZE = int(environ.get("RSS_SERVICE_DATES_CACHE_SIZE", "10000"))
+# max items kept for each feed, besides the largest limit requested for it
+# (0 means no limit)
+MAX_ITEMS = int(environ.get("RSS_SERVICE_MAX_ITEMS", "0"))
+# max length of the snippets: longer ones are turned into plain text and cut
+# (0 means no limit)
+SNIPPET_LENGTH = int(environ.get("RSS_SERVICE_SNIPPET_LENGTH", "0"))
+# refresh feeds in background before they expire (0 workers disables it)
+PREWARM_WORKERS = int(environ.get("RSS_SERVICE_PREWARM_WORKERS", "0"))
+PREWARM_LEAD = int(environ.get("RSS_SERVICE_PREWARM_LEAD", "60"))  # seconds
+PREWARM_JITTER = int(environ.get("RSS_SERVICE_PREWARM_JITTER", "60"))  # seconds
+# seconds before retrying a failing host, doubled at each consecutive failure
+BACKOFF_DELAY = int(environ.get("RSS_SERVICE_BACKOFF_DELAY", "60"))
+BACKOFF_MAX_DELAY = int(environ.get("RSS_SERVICE_BACKOFF_MAX_DELAY", "3600"))
+# consecutive failures that open the circuit of a host
+CIRCUIT_THRESHOLD = int(environ.get("RSS_SERVICE_CIRCUIT_THRESHOLD", "5")) or 5
+
+# store the feeds here (which means in RAM): url -> RSSMixerFeed
+# feeds not requested for a while are dropped, and the least recently
+# requested ones are evicted when there are too many
+FEED_DATA = BoundedCache(
+    max_entries=CACHE_MAX_FEEDS,
+    max_size=CACHE_MAX_SIZE * 1024 * 1024,
+    max_idle=CACHE_MAX_IDLE * 60,
+    sizeof=lambda feed: feed.size,
+)
+
+# serialized responses: (feeds, sources, limit) -> (feed versions, json body)
+# a response is valid until one of its feeds changes version
+RESPONSE_CACHE = BoundedCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_size=CACHE_MAX_SIZE * 1024 * 1024,
+    max_idle=CACHE_MAX_IDLE * 60,
+    sizeof=lambda value: len(value[1]),
+)
+
+# blocks of the contexts: path -> (object serial, {block id: block data})
+BLOCKS_INDEX = BoundedCache(
+    max_entries=BLOCKS_INDEX_MAX_ENTRIES,
+    max_idle=CACHE_MAX_IDLE * 60,
+)
+
+# refreshes the feeds requested recently (the ones in FEED_DATA) before they
+# expire, so requests find them already updated
+PREWARM_SCHEDULER = None
+if PREWARM_WORKERS:
+    PREWARM_SCHEDULER = RefreshScheduler(
+        job=lambda url: prewarm_feed(url),
+        max_workers=PREWARM_WORKERS,
+        jitter=PREWARM_JITTER,
+        name="rssmixer-prewarm",
+    )
+
+# circuit breakers of the hosts of the feeds: host -> CircuitBreaker
+BREAKERS = BoundedCache(
+    max_entries=CACHE_MAX_FEEDS,
+    max_idle=CACHE_MAX_IDLE * 60,
+)
+
+# each successful parse gives a new version to the feed
+FEED_VERSIONS = count(1)
+
+# shared by all the Zope threads: bounds the number of concurrent fetches
+FETCH_POOL = ThreadPoolExecutor(
+    max_workers=MAX_WORKERS, thread_name_prefix="rssmixer-fetch"
+)
+
+# urls with a background refresh in progress
+REFRESHING = set()
+REFRESHING_LOCK = Lock()
+
+# requests that waited for (or skipped) a fetch already in progress
+# for the same url, instead of doing their own
+COLLAPSED_REQUESTS = {"total": 0}
+COLLAPSED_REQUESTS_LOCK = Lock()
+
+# metrics of all the feeds (see @rss_mixer_stats)
+COUNTERS = Counters()
+REQUEST_DURATION = Histogram()
+FETCH_DURATION = Histogram()
+PARSE_DURATION = Histogram()
 
 
 class RSSMixerService(Service):
     """ """
 
+    def render(self):
+        start = time()
+        try:
+            return self._render()
+        finally:
+            REQUEST_DURATION.observe(time() - start)
+
+    def _render(self):
+        self.check_permission()
+        feeds, body, etag = self.get_response_body()
+        response = self.request.response
+        response.setHeader("Content-Type", self.content_type)
+        self.set_cache_headers(feeds=feeds, etag=etag)
+        if etag_matches(self.request.getHeader("If-None-Match", ""), etag):
+            response.setStatus(304)
+            return b""
+        return body
+
     def reply(self):
+        limit, feeds = self.get_feeds_parameters()
+        return self._getFeeds(feeds=feeds, limit=limit)
+
+    def get_response_body(self):
+        """Return the feeds, their serialization and its ETag, reusing the last
+        one computed for the same block configuration if none of its feeds
+        changed.
+        """
+        limit, feeds = self.get_feeds_parameters()
+        data = self._updatedFeeds(feeds=feeds, limit=limit)
+        key = (
+            tuple(
+                (feed_data.get("url", ""), feed_data.get("source", ""))
+                for feed_data in feeds
+            ),
+            limit,
+        )
+        versions = tuple(feed.version for feed in data)
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None and cached[0] == versions:
+            return data, cached[1], cached[2]
+        body = json.dumps(
+            self._sortedFeeds(feeds=data, limit=limit),
+            indent=2,
+            sort_keys=True,
+            separators=(", ", ": "),
+        ).encode("utf-8")
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        RESPONSE_CACHE[key] = (versions, body, etag)
+        return data, body, etag
+
+    def set_cache_headers(self, feeds, etag):
+        """Let browsers and proxies cache the response until the first of the
+        feeds expires, and revalidate it after that."""
+        response = self.request.response
+        response.setHeader("ETag", etag)
+        now = time()
+        expiration = min(feed.expiration_time for feed in feeds)
+        response.setHeader(
+            "Cache-Control", "max-age={}".format(max(int(expiration - now), 0))
+        )
+        last_update = max(feed.last_update_time_in_minutes for feed in feeds)
+        if last_update:
+            response.setHeader(
+                "Last-Modified", formatdate(last_update * 60, usegmt=True)
+            )
+
+    def get_feeds_parameters(self):
         feed_config = self.get_feed_config()
 
         limit = feed_config.get("limit", 20)
@@ -56,7 +271,7 @@ class RSSMixerService(Service):
                     context=self.request,
                 )
             )
-        return self._getFeeds(feeds=feeds, limit=limit)
+        return limit, feeds
 
     def get_feed_config(self):
         """ """
@@ -101,76 +316,454 @@ class RSSMixerService(Service):
         return block_data
 
     def get_block_data(self, block_id):
-        blocks = getattr(self.context, "blocks", {})
-        if not blocks:
-            return {}
-        if not isinstance(blocks, dict):
-            # plone < 6 support
-            blocks = json.loads(blocks)
-        rss_block = blocks.get(block_id, {})
-        if not rss_block:
-            # maybe is in some Block field
-            for schema in iterSchemata(self.context):
-                for name, field in getFields(schema).items():
-                    value = field.get(self.context)
-                    if not value:
-                        continue
-                    if not isinstance(value, dict):
-                        continue
-                    rss_block = value.get("blocks", {}).get(block_id, {})
-        return rss_block
+        index = get_blocks_index(self.context)
+        if index is not None:
+            return index.get(block_id, {})
+        for found_id, block in iter_blocks(self.context):
+            if found_id == block_id:
+                return block
+        return {}
 
     def _getFeeds(self, feeds, limit=20):
         """Return all feeds"""
+        return self._sortedFeeds(
+            feeds=self._updatedFeeds(feeds=feeds, limit=limit), limit=limit
+        )
+
+    def _updatedFeeds(self, feeds, limit=0):
+        """Return the RSSMixerFeed of each feed of the block, updated"""
         data = []
         for feed_data in feeds:
             url = feed_data.get("url", "")
             source = feed_data.get("source", "")
             feed = FEED_DATA.get(url, None)
             if feed is None:
-                # create it
-                feed = FEED_DATA[url] = RSSMixerFeed(
-                    url=url,
-                    source=source,
-                    timeout=100,
+                # create it (setdefault: another thread could be doing the same)
+                feed = FEED_DATA.setdefault(
+                    url,
+                    RSSMixerFeed(
+                        url=url,
+                        source=source,
+                        timeout=REFRESH_INTERVAL,
+                    ),
                 )
-            # if it's new, populate it, else try to see if it need to be updated
-            else:
-                # check if we need to update the source
-                if feed.source != source:
-                    feed.source = source
-            feed.update()
+            # check if we need to update the source
+            if feed.source != source:
+                feed.source = source
+            feed.refresh_interval = get_refresh_interval(feed_data)
+            # no more items than the largest limit requested are needed
+            if limit and limit > feed.max_limit:
+                feed.max_limit = limit
+            # resolve internal urls here: worker threads have no site set
+            feed.resolved_url = uid_to_url(url)
             data.append(feed)
-        return self._sortedFeeds(feeds=data, limit=limit)
+        self._updateFeeds(feeds=data)
+        if PREWARM_SCHEDULER is not None:
+            for feed in data:
+                if not PREWARM_SCHEDULER.is_scheduled(feed.url):
+                    PREWARM_SCHEDULER.schedule(feed.url, next_prewarm_time(feed))
+        return data
+
+    def _updateFeeds(self, feeds):
+        """Update feeds in parallel, so the slowest feed sets the latency"""
+        stale = []
+        for feed in feeds:
+            if feed in stale:
+                continue
+            if not (feed.needs_update or feed.update_failed or not feed.loaded):
+                feed.count("hits")
+                continue
+            if feed.can_serve_stale:
+                # does not block: the refresh is done in background
+                feed.count("stale_hits")
+                feed.update()
+                continue
+            feed.count("misses")
+            stale.append(feed)
+        if len(stale) == 1:
+            stale[0].update()
+        elif stale:
+            futures = [FETCH_POOL.submit(feed.update) for feed in stale]
+            wait(futures)
+            for feed, future in zip(stale, futures):
+                if future.exception():
+                    logger.error(
+                        "Error updating feed %s: %s", feed.url, future.exception()
+                    )
 
     def _sortedFeeds(self, feeds, limit):
-        """Sort feed items by date"""
+        """Sort feed items by date, and return them as dicts.
 
-        itemsWithDate = []
-        itemsWithoutDate = []
-        for feed in feeds:
-            for item in feed.items:
-                if "date" in item:
-                    itemsWithDate.append(item)
-                else:
-                    itemsWithoutDate.append(item)
-        sortedItems = sorted(itemsWithDate, key=lambda d: d["date"], reverse=True)
-        total = sortedItems + itemsWithoutDate
+        Items of each feed are already sorted (items with a date first), so
+        they are merged lazily and we stop as soon as we have enough items.
+        """
+        feeds_items = [feed.items for feed in feeds]
+        itemsWithDate = heapq.merge(
+            *[takewhile(has_date, items) for items in feeds_items],
+            key=attrgetter("timestamp"),
+            reverse=True,
+        )
+        itemsWithoutDate = chain.from_iterable(
+            dropwhile(has_date, items) for items in feeds_items
+        )
+        return [
+            item.to_dict()
+            for item in islice(chain(itemsWithDate, itemsWithoutDate), limit)
+        ]
+
+
+def get_refresh_interval(feed_data):
+    """Return the refresh interval in minutes set for a feed in the block."""
+    try:
+        interval = int(feed_data.get("refresh_interval") or 0)
+    except (TypeError, ValueError):
+        return None
+    if interval <= 0:
+        return None
+    return interval
+
+
+def get_feed_interval(parsed_feed):
+    """Return the refresh interval in minutes declared by the feed with <ttl>,
+    sy:updatePeriod or the Cache-Control of the response, or None."""
+    feed = parsed_feed.get("feed", {})
+    interval = None
+    try:
+        if feed.get("ttl"):
+            interval = int(feed["ttl"])
+        elif feed.get("sy_updateperiod") in SY_UPDATE_PERIODS:
+            frequency = int(feed.get("sy_updatefrequency") or 1)
+            interval = SY_UPDATE_PERIODS[feed["sy_updateperiod"]] / max(frequency, 1)
+    except (TypeError, ValueError):
+        pass
+    if interval is None and parsed_feed.get("max_age"):
+        interval = parsed_feed["max_age"] / 60
+    if interval is None:
+        return None
+    return min(max(interval, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+
+
+def get_max_age(cache_control):
+    """Return the max-age in seconds of a Cache-Control header, or None."""
+    if not cache_control or "no-cache" in cache_control or "no-store" in cache_control:
+        return None
+    match = MAX_AGE_RE.search(cache_control)
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+def next_prewarm_time(feed):
+    """Return when the feed should be refreshed by the prewarm scheduler."""
+    if feed.update_failed:
+        return feed.retry_time
+    return max(feed.expiration_time - PREWARM_LEAD, feed.next_attempt_time)
+
+
+def get_breaker(url):
+    """Return the circuit breaker of the host of the url."""
+    host = urlparse(url).netloc.lower()
+    breaker = BREAKERS.get(host)
+    if breaker is None:
+        breaker = BREAKERS.setdefault(
+            host,
+            CircuitBreaker(
+                threshold=CIRCUIT_THRESHOLD,
+                base_delay=BACKOFF_DELAY,
+                max_delay=BACKOFF_MAX_DELAY,
+                probe_timeout=REQUESTS_TIMEOUT * 2,
+            ),
+        )
+    return breaker
+
+
+def prewarm_feed(url):
+    """Refresh the feed, if it's still used, and return when to do it again."""
+    # peek: the prewarm should not keep alive feeds that nobody requests
+    feed = FEED_DATA.peek(url)
+    if feed is None:
+        return None
+    if time() >= next_prewarm_time(feed):
+        logger.debug("Prewarm %s", url)
+        feed._refresh()
+    # do not loop if the feed can't be refreshed
+    return max(next_prewarm_time(feed), time() + PREWARM_LEAD)
+
+
+def iter_blocks(context):
+    """Iterate over (id, data) of the blocks of the context, and then of the
+    blocks in its Block fields."""
+    blocks = getattr(context, "blocks", {})
+    if not blocks:
+        return
+    if not isinstance(blocks, dict):
+        # plone < 6 support
+        blocks = json.loads(blocks)
+    yield from blocks.items()
+    # maybe is in some Block field
+    for schema in iterSchemata(context):
+        for name, field in getFields(schema).items():
+            value = field.get(context)
+            if not value:
+                continue
+            if not isinstance(value, dict):
+                continue
+            yield from value.get("blocks", {}).items()
+
+
+def get_blocks_index(context):
+    """Return a dict block id -> block data of the context, computed again only
+    when the context is modified. Only rssBlocks are stored with their data.
+
+    Return None if the context can't be indexed (e.g. it's not stored yet,
+    so its serial does not change when it's modified).
+    """
+    get_path = getattr(context, "getPhysicalPath", None)
+    # the serial of a ghost is not loaded yet
+    activate = getattr(context, "_p_activate", None)
+    if activate is not None:
+        activate()
+    serial = getattr(context, "_p_serial", None)
+    if (
+        get_path is None
+        or getattr(context, "_p_jar", None) is None
+        or serial in (None, z64)
+        or getattr(context, "_p_changed", False)
+    ):
+        return None
+    key = "/".join(get_path())
+    cached = BLOCKS_INDEX.get(key)
+    if cached is not None and cached[0] == serial:
+        return cached[1]
+    index = {}
+    for block_id, block in iter_blocks(context):
+        if block_id in index or not isinstance(block, dict):
+            continue
+        block_type = block.get("@type", "")
+        if block_type == "rssBlock":
+            index[block_id] = deepcopy(block)
+        else:
+            index[block_id] = {"@type": block_type}
+    BLOCKS_INDEX[key] = (serial, index)
+    return index
+
+
+class ItemsCounter(object):
+    """Parse a feed while it's downloaded to count its items, and stop the
+    download when there are enough (see read_content).
+
+    The download stops early only if the items are sorted newest first, as
+    the most recent ones are needed: the item after the last needed one is
+    read too, so that the order is checked also for a single item.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.newest_first = True
+        self._timestamp = None
+        self._end = None
+        self._depth = 0
+        self._item_depth = None
+        self._dates = {}
+        self._text = None
+        self._parser = ParserCreate(namespace_separator="}")
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end_element
+        self._parser.CharacterDataHandler = self._data
+
+    def __call__(self, chunk):
+        if self._parser is None:
+            return False
+        try:
+            self._parser.Parse(chunk)
+        except ExpatError:
+            # not well-formed (e.g. html entities): feedparser will deal
+            # with it, but it must be downloaded completely
+            self.newest_first = False
+        if not self.newest_first:
+            self._parser = None
+            return False
+        return self.count > self.limit
+
+    def truncate(self, content):
+        """Cut the content of the feed after the last needed item."""
+        return content[: content.index(b">", self._end) + 1]
+
+    def _start(self, name, attrs):
+        self._depth += 1
+        tag = name.rsplit("}", 1)[-1]
+        if self._item_depth is None:
+            if tag in ("item", "entry"):
+                self._item_depth = self._depth
+                self._dates = {}
+        elif self._depth == self._item_depth + 1:
+            if tag in UPDATED_TAGS:
+                self._text = self._dates.setdefault("updated", [])
+            elif tag in PUBLISHED_TAGS:
+                self._text = self._dates.setdefault("published", [])
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _end_element(self, name):
+        self._text = None
+        if self._depth == self._item_depth:
+            self._item_depth = None
+            self._counted()
+        self._depth -= 1
+
+    def _counted(self):
+        # the date used to sort the items (see get_item_date)
+        text = self._dates.get("updated") or self._dates.get("published") or ()
+        value = "".join(text).strip()
+        timestamp = normalize_date(value)[1] if value else None
+        if timestamp is None or (
+            self._timestamp is not None and timestamp > self._timestamp
+        ):
+            self.newest_first = False
+        self._timestamp = timestamp
+        self.count += 1
+        if self.count == self.limit:
+            # where its end tag starts
+            self._end = self._parser.CurrentByteIndex
+
+
+class FeedItem(
+    namedtuple(
+        "FeedItem",
+        (
+            "title",
+            "url",
+            "snippet",
+            "source",
+            "date",
+            "timestamp",
+            "image",
+            "categories",
+        ),
+        defaults=("", "", "", "", "", None, "", ()),
+    )
+):
+    """An item of a feed.
+
+    Feeds keep a lot of items for a long time, so they are compact immutable
+    tuples, turned into the dicts of the response only when serialized.
+    timestamp is the date to sort the item (None if it has no date, or it
+    can't be parsed).
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            title=data["title"],
+            url=data.get("url", ""),
+            snippet=data.get("contentSnippet", ""),
+            source=intern(data.get("source", "")),
+            date=data.get("date", ""),
+            timestamp=get_timestamp(data.get("date")),
+            image=data.get("enclosure", {}).get("url", ""),
+            categories=tuple(data.get("categories", ())),
+        )
+
+    def to_dict(self):
+        data = {
+            "title": self.title,
+            "url": self.url,
+            "contentSnippet": self.snippet,
+            "source": self.source,
+        }
+        if self.date:
+            data["date"] = self.date
+        if self.image:
+            # format needed in blocks to keep compatibility
+            data["enclosure"] = {"url": self.image}
+        if self.categories:
+            data["categories"] = list(self.categories)
+        return data
+
+
+def get_snippet(description):
+    """Return the snippet of an item, cut to SNIPPET_LENGTH characters.
+
+    Longer snippets are turned into escaped text: the unescaped entities
+    could be markup.
+    """
+    if not SNIPPET_LENGTH or len(description) <= SNIPPET_LENGTH:
+        return description
+    # html can't be cut safely
+    text = SPACES_RE.sub(" ", unescape(TAG_RE.sub(" ", description))).strip()
+    if len(text) > SNIPPET_LENGTH:
+        text = text[:SNIPPET_LENGTH].rsplit(" ", 1)[0] + "\u2026"
+    return escape(text)
 
-        # fix date format
-        return total[:limit]
+
+def has_date(item):
+    return item.timestamp is not None
+
+
+@lru_cache(maxsize=DATES_CACHE_SIZE)
+def normalize_date(value, parsed=None):
+    """Return a date of a feed as ISO string in UTC, and its timestamp.
+
+    The date is taken from the time tuple parsed by feedparser, or else from
+    the string. If it can't be parsed, return the string and None.
+    """
+    if parsed:
+        timestamp = timegm(parsed)
+    else:
+        try:
+            timestamp = DateTime(value).timeTime()
+        except (DateTimeError, ValueError, OverflowError):
+            return value, None
+    try:
+        date = datetime.fromtimestamp(int(timestamp), timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return value, None
+    return date.isoformat(), timestamp
+
+
+def get_timestamp(date):
+    """Return the timestamp of an ISO date returned by normalize_date."""
+    try:
+        return datetime.fromisoformat(date).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def get_items_size(items):
+    """Estimate the size in bytes of a list of feed items."""
+    size = 0
+    for item in items:
+        size += (
+            len(item.title)
+            + len(item.url)
+            + len(item.snippet)
+            + len(item.date)
+            + len(item.image)
+            + sum(len(category) for category in item.categories)
+        )
+    return size
 
 
 @implementer(IRSSMixerFeed)
 class RSSMixerFeed(object):
     """An RSS feed."""
 
+    # minutes before retrying a feed that fails while its host replies
+    # (e.g. not found or invalid); failing hosts are retried with a backoff
     FAILURE_DELAY = 10
 
     def __init__(self, url, source, timeout):
         self.url = url
-        self.timeout = timeout
+        self.timeout = timeout  # default minutes between updates
+        self.refresh_interval = None  # minutes between updates set in the block
+        self._feed_interval = None  # minutes between updates set by the feed
         self.source = source
+        self.resolved_url = url
         self._items = []
         self._title = ""
         self._siteurl = ""
@@ -178,6 +771,22 @@ class RSSMixerFeed(object):
         self._failed = False  # does it fail at the last update?
         self._last_update_time_in_minutes = 0  # when was the feed updated?
         self._last_update_time = None  # time as DateTime or Nonw
+        self._retry_time = 0  # when a failed feed can be retried
+        self._next_attempt_time = 0  # not requested before, its host is failing
+        self.max_limit = 0  # largest number of items requested
+        self._items_limit = 0  # items were retrieved up to this limit
+        self._lock = Lock()  # held while the feed is retrieved
+        self._size = 0  # estimated size of the items in bytes
+        self._version = 0  # changes every time the items change
+        self._etag = None  # validators of the last parsed response
+        self._last_modified = None
+        self._collapsed_requests = 0
+        # metrics
+        self._counters = Counters()  # hits, misses, refreshes...
+        self._consecutive_failures = 0
+        self._fetch_duration = None  # seconds of the last download
+        self._fetch_bytes = None  # size of the last download
+        self._parse_duration = None  # seconds of the last parse
 
     @property
     def last_update_time_in_minutes(self):
@@ -189,6 +798,77 @@ class RSSMixerFeed(object):
         """Return the time the last update was done in minutes."""
         return self._last_update_time
 
+    @property
+    def version(self):
+        """Return the version of the items, changed by each successful parse."""
+        return self._version
+
+    @property
+    def size(self):
+        """Return the estimated size in bytes of the items of this feed."""
+        return self._size
+
+    @property
+    def collapsed_requests(self):
+        """Return how many updates reused a retrieve already in progress."""
+        return self._collapsed_requests
+
+    def count(self, name):
+        """Increment a counter of this feed, and the one of all the feeds."""
+        self._counters.incr(name)
+        COUNTERS.incr(name)
+
+    def get_metrics(self):
+        """Return the metrics of this feed."""
+        metrics = {
+            "url": self.url,
+            "loaded": self.loaded,
+            "failed": self.update_failed,
+            "consecutive_failures": self._consecutive_failures,
+            "last_update": self._last_update_time_in_minutes * 60,
+            "interval": self.interval,
+            "items": len(self._items),
+            "size": self._size,
+            "fetch_duration": self._fetch_duration,
+            "fetch_bytes": self._fetch_bytes,
+            "parse_duration": self._parse_duration,
+            "collapsed_requests": self._collapsed_requests,
+        }
+        for name in (
+            "hits",
+            "stale_hits",
+            "misses",
+            "refreshes",
+            "not_modified",
+            "failures",
+            "circuit_open",
+        ):
+            metrics[name] = self._counters.get(name)
+        return metrics
+
+    @property
+    def interval(self):
+        """Return the minutes between updates: the ones set in the block, or
+        declared by the feed, or the default ones."""
+        return self.refresh_interval or self._feed_interval or self.timeout
+
+    @property
+    def expiration_time(self):
+        """Return when this feed will need an update, in seconds since epoch."""
+        return (self.last_update_time_in_minutes + self.interval) * 60
+
+    @property
+    def retry_time(self):
+        """Return when a failed feed can be retrieved again, in seconds since
+        epoch."""
+        return self._retry_time
+
+    @property
+    def next_attempt_time(self):
+        """Return when the feed can be requested again, if the last request was
+        skipped because its host is failing, in seconds since epoch."""
+        return self._next_attempt_time
+
     @property
     def update_failed(self):
         return self._failed
@@ -205,54 +885,267 @@ class RSSMixerFeed(object):
     @property
     def needs_update(self):
         """Check if this feed needs updating."""
-        now = time() / 6
-        return (self.last_update_time_in_minutes + self.timeout) < now
+        if time() < self._next_attempt_time:
+            # its host is failing: keep the items we already have
+            return False
+        now = time() / 60
+        return (
+            self.last_update_time_in_minutes + self.interval
+        ) < now or self.truncated
+
+    @property
+    def max_items(self):
+        """Return how many items of the feed are kept (0 means all)."""
+        limits = [limit for limit in (self.max_limit, MAX_ITEMS) if limit]
+        return min(limits) if limits else 0
+
+    @property
+    def truncated(self):
+        """Check if more items than the retrieved ones are requested."""
+        return self._needs_more_items(self._items_limit)
+
+    def _needs_more_items(self, items_limit):
+        if not items_limit:
+            return False
+        return not self.max_items or self.max_items > items_limit
 
     def update(self):
         """Update this feed."""
-        now = time() / 60  # time in minutes
-        # check for failure and retry
+        # check for failure and retry (the items of the last successful
+        # update are kept in the meantime)
         if self.update_failed:
-            if (self.last_update_time_in_minutes + self.FAILURE_DELAY) < now:
-                return self._retrieveFeed()
+            if self.retry_time < time():
+                return self._refresh()
             else:
                 return False
 
-        # check for regular update
-        if self.needs_update:
-            return self._retrieveFeed()
+        # check for regular update (or wait for the first one in progress)
+        if self.needs_update or not self.loaded:
+            if self.can_serve_stale:
+                self.refresh_in_background()
+                return self.ok
+            return self._refresh()
 
         return self.ok
 
-    def _getFeedFromUrl(self, url):
+    def _refresh(self):
+        """Retrieve the feed, but only one thread at a time does it.
+
+        The others return the previous items if the feed was already loaded,
+        or wait for the result of the retrieve in progress.
+        """
+        last_update = self._last_update_time_in_minutes
+        if self._lock.acquire(blocking=False):
+            try:
+                if self._last_update_time_in_minutes != last_update:
+                    # updated by another thread in the meantime
+                    self._collapsed()
+                    return self.ok
+                return self._retrieveSharedFeed()
+            finally:
+                self._lock.release()
+        self._collapsed()
+        if self.loaded:
+            return self.ok
+        with self._lock:
+            return self.ok
+
+    def _retrieveSharedFeed(self):
+        """Retrieve the feed, but only one process at a time does it: the
+        others load it from the shared storage.
         """
-        Use urllib to retrieve an rss feed.
-        In this way, we can manage timeouts.
+        storage = get_feed_storage()
+        if self._loadFromStorage(storage):
+            return self.ok
+        # the lock expires if the process holding it dies
+        lock_timeout = REQUESTS_TIMEOUT * 2 + 5
+        if not storage.acquire(self.url, timeout=lock_timeout):
+            # another process is retrieving it
+            self._collapsed()
+            if self.loaded:
+                return self.ok
+            deadline = time() + REQUESTS_TIMEOUT
+            while time() < deadline:
+                sleep(0.2)
+                if self._loadFromStorage(storage):
+                    return self.ok
+                if storage.acquire(self.url, timeout=lock_timeout):
+                    # released without a new feed (e.g. the retrieve failed),
+                    # or just saved
+                    if self._loadFromStorage(storage):
+                        storage.release(self.url)
+                        return self.ok
+                    break
+        try:
+            version = self._version
+            last_update = self._last_update_time_in_minutes
+            result = self._retrieveFeed()
+            if result and self._version != version:
+                storage.save(self.url, self.get_state())
+            elif result and self._last_update_time_in_minutes != last_update:
+                # not modified (and not skipped because its host is failing)
+                storage.touch(self.url, self._last_update_time_in_minutes * 60)
+            return result
+        finally:
+            storage.release(self.url)
+
+    def _loadFromStorage(self, storage):
+        """Load the feed from the storage, if it was updated there by another
+        process and it's not expired."""
+        state = storage.load(
+            self.url, newer_than=self._last_update_time_in_minutes * 60
+        )
+        if state is None:
+            return False
+        if self._needs_more_items(state["items_limit"]):
+            return False
+        interval = self.refresh_interval or state["interval"] or self.timeout
+        if (state["last_update"] / 60 + interval) < time() / 60:
+            return False
+        self.set_state(state)
+        return True
+
+    def get_state(self):
+        """Return the data of this feed that can be shared with other processes."""
+        return {
+            "last_update": self._last_update_time_in_minutes * 60,
+            "title": self._title,
+            "siteurl": self._siteurl,
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "interval": self._feed_interval,
+            "items_limit": self._items_limit,
+            "items": [item.to_dict() for item in self._items],
+        }
+
+    def set_state(self, state):
+        """Set the data of this feed from another process."""
+        self._last_update_time_in_minutes = state["last_update"] / 60
+        self._last_update_time = DateTime(state["last_update"])
+        self._title = state["title"]
+        self._siteurl = state["siteurl"]
+        self._etag = state["etag"]
+        self._last_modified = state["last_modified"]
+        self._feed_interval = state["interval"]
+        self._items_limit = state["items_limit"]
+        self._items = [FeedItem.from_dict(item) for item in state["items"]]
+        self._size = get_items_size(self._items)
+        self._version = next(FEED_VERSIONS)
+        self._loaded = True
+        self._failed = False
+
+    def _collapsed(self):
+        logger.debug("Reuse the retrieve in progress for %s", self.url)
+        with COLLAPSED_REQUESTS_LOCK:
+            self._collapsed_requests += 1
+            COLLAPSED_REQUESTS["total"] += 1
+
+    @property
+    def can_serve_stale(self):
+        """Check if this feed can be served while it's refreshed in background."""
+        if not MAX_STALENESS or not self.ok:
+            return False
+        now = time() / 60
+        return (self.last_update_time_in_minutes + self.interval + MAX_STALENESS) > now
+
+    def refresh_in_background(self):
+        """Schedule a refresh of this feed, only one at a time for each url."""
+        with REFRESHING_LOCK:
+            if self.url in REFRESHING:
+                return False
+            REFRESHING.add(self.url)
+
+        def refresh():
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error("Error refreshing feed %s: %s", self.url, e)
+            finally:
+                with REFRESHING_LOCK:
+                    REFRESHING.discard(self.url)
+
+        FETCH_POOL.submit(refresh)
+        return True
+
+    def _getFeedFromUrl(self, url, breaker):
+        """
+        Use requests to retrieve an rss feed, with a pool of connections kept
+        alive. In this way, we can manage timeouts.
         """
-        url = uid_to_url(url)
         headers = {}
         if REQUESTS_USER_AGENT:
             headers["User-Agent"] = REQUESTS_USER_AGENT
+        # conditional request: the origin can reply 304 if nothing changed
+        # (but more items are needed if it was truncated)
+        if self._etag and not self.truncated:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified and not self.truncated:
+            headers["If-Modified-Since"] = self._last_modified
         try:
             if RSSMIXER_HTTP_PROXY:
                 url = f"{RSSMIXER_HTTP_PROXY}/{url}"
-            response = requests.get(
+            start = time()
+            response = get_session().get(
                 url,
                 headers=headers,
                 timeout=REQUESTS_TIMEOUT,
+                stream=True,
             )
         except (Timeout, RequestException) as e:
             logger.warning("exception %s during %s request", e, url)
+            breaker.failure()
+            self._retry_time = breaker.retry_time
             return None
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.failure()
+            self._retry_time = breaker.retry_time
+        else:
+            breaker.success()
+        if response.status_code == 304:
+            response.close()
+            self._setFetchMetrics(start, 0)
+            self.count("not_modified")
+            return NOT_MODIFIED
         if response.status_code != 200:
-            message = response.text or response.reason
+            response.close()
             logger.error(
                 "Unable to retrieve feed from {url}: {message}".format(
-                    url=url, message=message
+                    url=url, message=response.reason
                 )
             )
             return None
-        return feedparser.parse(response.content)
+        # download only the items needed, and not too much anyway
+        limit = self.max_items
+        counter = ItemsCounter(limit) if limit else None
+        try:
+            content, truncated = read_content(response, stop=counter)
+        except (Timeout, RequestException) as e:
+            logger.error("Unable to retrieve feed from %s: %s", url, e)
+            return None
+        self._setFetchMetrics(start, len(content))
+        if truncated:
+            content = counter.truncate(content)
+        start = time()
+        parsed_feed = parse_feed(content, truncated=truncated)
+        self._parse_duration = time() - start
+        PARSE_DURATION.observe(self._parse_duration)
+        parsed_feed["items_limit"] = truncated and limit or 0
+        parsed_feed["etag"] = response.headers.get("ETag")
+        parsed_feed["modified"] = response.headers.get("Last-Modified")
+        parsed_feed["max_age"] = get_max_age(response.headers.get("Cache-Control"))
+        return parsed_feed
+
+    def _setFetchMetrics(self, start, size):
+        self._fetch_duration = time() - start
+        self._fetch_bytes = size
+        FETCH_DURATION.observe(self._fetch_duration)
+
+    def _failedUpdate(self):
+        self._loaded = True  # we tried at least but have a failed load
+        self._failed = True
+        self._consecutive_failures += 1
+        self.count("failures")
+        return False
 
     def _retrieveFeed(self):
         """Do the actual work and try to retrieve the feed."""
@@ -262,48 +1155,86 @@ class RSSMixerFeed(object):
             self._failed = True  # no url set means failed
             # no url set, although that actually should not really happen
             return False
+        # fail fast if the host is failing, without waiting for its timeouts:
+        # the feed is not updated, and it keeps the items it already has
+        breaker = get_breaker(self.resolved_url)
+        if not breaker.allow():
+            logger.debug("Skip the request to %s: its host is failing", url)
+            self.count("circuit_open")
+            self._retry_time = self._next_attempt_time = breaker.retry_time
+            if not self._loaded:
+                self._loaded = True
+                self._failed = True
+            return self.ok
+        self.count("refreshes")
+        self._next_attempt_time = 0
         self._last_update_time_in_minutes = time() / 60
         self._last_update_time = DateTime()
-        parsed_feed = self._getFeedFromUrl(url)
+        # if the feed fails (the delay of failing hosts is set by the backoff)
+        self._retry_time = time() + self.FAILURE_DELAY * 60
+        parsed_feed = self._getFeedFromUrl(self.resolved_url, breaker)
+        if parsed_feed is NOT_MODIFIED:
+            # keep the items we already have
+            self._loaded = True
+            self._failed = False
+            self._consecutive_failures = 0
+            return True
         if not parsed_feed:
-            self._loaded = True  # we tried at least but have a failed load
-            self._failed = True
-            return False
-        if parsed_feed.bozo == 1 and not isinstance(
-            parsed_feed.get("bozo_exception"),
-            ACCEPTED_FEEDPARSER_EXCEPTIONS,
+            return self._failedUpdate()
+        # a truncated feed is not well-formed, on purpose
+        if (
+            parsed_feed.bozo == 1
+            and not parsed_feed["items_limit"]
+            and not isinstance(
+                parsed_feed.get("bozo_exception"),
+                ACCEPTED_FEEDPARSER_EXCEPTIONS,
+            )
         ):
-            self._loaded = True  # we tried at least but have a failed load
-            self._failed = True
-            return False
+            return self._failedUpdate()
         self._title = parsed_feed.feed.title
         self._siteurl = parsed_feed.feed.link
-        self._items = []
-
+        entries = []
         for item in parsed_feed["items"]:
-            itemdict = {
-                "title": item.title,
-                "url": item.get("link", ""),
-                "contentSnippet": item.get("description", ""),
-                "source": getattr(self, "source", ""),
-            }
-
-            date = self.get_item_date(item=item)
-            if date:
-                itemdict["date"] = date
-
-            image = self.get_item_image(item=item)
-            if image:
-                # format needed in blocks to keep compatibility
-                itemdict["enclosure"] = image
-
-            categories = self.get_item_categories(item=item)
-            if categories:
-                itemdict["categories"] = categories
-
-            self._items.append(itemdict)
+            date, timestamp = self.get_item_date(item=item)
+            entries.append((timestamp, date, item))
+        # sorted by date once here, so feeds can be merged without sorting
+        # again: items without a (valid) date go last, in their original order
+        entries = sorted(
+            (entry for entry in entries if entry[0] is not None),
+            key=itemgetter(0),
+            reverse=True,
+        ) + [entry for entry in entries if entry[0] is None]
+        # keep only the most recent items that can be requested
+        items_limit = parsed_feed["items_limit"]
+        max_items = self.max_items
+        if max_items and len(entries) > max_items:
+            entries = entries[:max_items]
+            items_limit = max_items
+        # build a new list: other threads can read the items in the meantime
+        source = intern(getattr(self, "source", "") or "")
+        items = [
+            FeedItem(
+                title=item.title,
+                url=item.get("link", ""),
+                snippet=get_snippet(item.get("description", "")),
+                source=source,
+                date=date,
+                timestamp=timestamp,
+                image=self.get_item_image(item=item).get("url", ""),
+                categories=tuple(self.get_item_categories(item=item)),
+            )
+            for timestamp, date, item in entries
+        ]
+        self._items = items
+        self._size = get_items_size(items)
+        self._version = next(FEED_VERSIONS)
+        self._etag = parsed_feed.get("etag")
+        self._last_modified = parsed_feed.get("modified")
+        self._feed_interval = get_feed_interval(parsed_feed)
+        self._items_limit = items_limit
         self._loaded = True
         self._failed = False
+        self._consecutive_failures = 0
         return True
 
     def get_item_categories(self, item):
@@ -316,18 +1247,12 @@ class RSSMixerFeed(object):
         return categories
 
     def get_item_date(self, item):
-        if getattr(item, "updated", None):
-            try:
-                return json_compatible(DateTime(item.updated))
-            except SyntaxError:
-                return json_compatible(item.updated)
-        elif getattr(item, "published", None):
-            try:
-                return json_compatible(DateTime(item.published))
-            except SyntaxError:
-                return json_compatible(item.published)
-
-        return ""
+        """Return the date of the item as ISO string and its timestamp."""
+        for key in ("updated", "published"):
+            value = item.get(key)
+            if value:
+                return normalize_date(value, item.get(f"{key}_parsed"))
+        return "", None
 
     def get_item_image(self, item):
         image = ""
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heappop
+from heapq import heappush
+from itertools import count
+from random import uniform
+from threading import BoundedSemaphore
+from threading import Condition
+from threading import Thread
+from time import time
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler(object):
+    """Run a job for each key at the time it is scheduled, in a pool of workers.
+
+    Keys wait in a heap ordered by time, and each key has at most one pending
+    run. The job is called with the key and returns when it should run again
+    (seconds since epoch), or None to stop.
+
+    Every run is anticipated by a random delay up to jitter seconds, to spread
+    the runs scheduled at the same time.
+    """
+
+    def __init__(self, job, max_workers=4, jitter=0, name="refresh-scheduler"):
+        self.job = job
+        self.max_workers = max_workers
+        self.jitter = jitter
+        self.name = name
+        self._heap = []  # (time, sequence, key)
+        self._pending = {}  # key: time
+        self._sequence = count()
+        self._condition = Condition()
+        self._workers = BoundedSemaphore(max_workers)
+        self._pool = None
+        self._thread = None
+        self._stopped = False
+
+    @property
+    def queue_depth(self):
+        """Return the number of keys waiting for their run."""
+        return len(self._pending)
+
+    def is_scheduled(self, key):
+        return key in self._pending
+
+    def schedule(self, key, when):
+        """Schedule a run of the key at the given time. If it's already
+        scheduled, only the earliest run is kept."""
+        if self.jitter:
+            when -= uniform(0, self.jitter)
+        with self._condition:
+            current = self._pending.get(key)
+            if current is not None and current <= when:
+                return False
+            self._pending[key] = when
+            heappush(self._heap, (when, next(self._sequence), key))
+            self._condition.notify()
+        self.start()
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=self.name
+            )
+            self._thread = Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._pool.shutdown(wait=True)
+            self._thread = None
+            self._pool = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                key = self._next_key()
+                if key is None:
+                    return
+            # wait for a free worker, so a key is never queued in the pool
+            # while it could be scheduled again
+            self._workers.acquire()
+            self._pool.submit(self._work, key)
+
+    def _next_key(self):
+        """Wait for the next key to run. Return None if stopped."""
+        while not self._stopped:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            when, sequence, key = self._heap[0]
+            delay = when - time()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+            heappop(self._heap)
+            if self._pending.get(key) != when:
+                # superseded by an earlier run
+                continue
+            del self._pending[key]
+            return key
+        return None
+
+    def _work(self, key):
+        try:
+            when = self.job(key)
+        except Exception as e:
+            logger.exception("Error running %s for %s: %s", self.name, key, e)
+            when = None
+        finally:
+            self._workers.release()
+        if when is not None:
+            self.schedule(key, when)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from http.cookiejar import DefaultCookiePolicy
+from os import environ
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from threading import Lock
+from time import time
+
+import requests
+
+
+# number of hosts with a pool of connections kept alive
+POOL_CONNECTIONS = int(environ.get("RSS_SERVICE_POOL_CONNECTIONS", "20")) or 20
+# max number of connections kept alive for each host
+POOL_MAXSIZE = int(environ.get("RSS_SERVICE_POOL_MAXSIZE", "4")) or 4
+# max size in bytes of a downloaded feed (0 means no limit)
+MAX_BYTES = int(environ.get("RSS_SERVICE_MAX_BYTES", str(10 * 1024 * 1024)))
+# max seconds to download a feed (0 means no limit)
+DOWNLOAD_DEADLINE = int(environ.get("RSS_SERVICE_DOWNLOAD_DEADLINE", "30"))
+CHUNK_SIZE = 16 * 1024
+
+_session = None
+_session_lock = Lock()
+
+
+def get_session():
+    """Return the requests.Session shared by all the threads.
+
+    Connections are kept alive and reused for every request to the same host.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = make_session()
+    return _session
+
+
+def make_session():
+    session = requests.Session()
+    # do not share cookies of a site between requests of different threads
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class DownloadError(RequestException):
+    """The response is too large or too slow to download."""
+
+
+def read_content(response, max_bytes=None, deadline=None, stop=None):
+    """Read the body of a response requested with stream=True, without keeping
+    in memory more than max_bytes or waiting more than deadline seconds
+    (MAX_BYTES and DOWNLOAD_DEADLINE by default).
+
+    stop is called with each chunk read, and the download ends early when it
+    returns True. Return the content and whether the download ended early.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    if deadline is None:
+        deadline = DOWNLOAD_DEADLINE
+    end = deadline and time() + deadline
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise DownloadError(f"response larger than {max_bytes} bytes")
+            chunks.append(chunk)
+            if stop is not None and stop(chunk):
+                return b"".join(chunks), True
+            if end and time() > end:
+                raise DownloadError(f"response not downloaded in {deadline} seconds")
+    finally:
+        response.close()
+    return b"".join(chunks), False
+
+
+def etag_matches(if_none_match, etag):
+    """Check if an If-None-Match request header matches the given ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value.startswith("W/"):
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
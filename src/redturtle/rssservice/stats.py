@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from plone.restapi.services import Service
+from redturtle.rssservice import rss_mixer
+from redturtle.rssservice.metrics import prometheus_text
+
+
+class RSSMixerStatsService(Service):
+    """Metrics of the feeds retrieved by this process.
+
+    Returned in the Prometheus text format with ?format=prometheus.
+    """
+
+    def render(self):
+        if self.request.form.get("format") == "prometheus":
+            self.check_permission()
+            self.request.response.setHeader(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+            )
+            return prometheus_text(self.get_prometheus_metrics())
+        return super().render()
+
+    def reply(self):
+        # the slowest feeds first
+        feeds = sorted(
+            (feed.get_metrics() for feed in rss_mixer.FEED_DATA.values()),
+            key=lambda metrics: metrics["fetch_duration"] or 0,
+            reverse=True,
+        )
+        scheduler = rss_mixer.PREWARM_SCHEDULER
+        return {
+            "feeds": feeds,
+            "counters": rss_mixer.COUNTERS.stats(),
+            "collapsed_requests": rss_mixer.COLLAPSED_REQUESTS["total"],
+            "feeds_cache": rss_mixer.FEED_DATA.stats(),
+            "response_cache": rss_mixer.RESPONSE_CACHE.stats(),
+            "blocks_index": rss_mixer.BLOCKS_INDEX.stats(),
+            "hosts": {
+                host: {"state": breaker.state, "failures": breaker.failures}
+                for host, breaker in rss_mixer.BREAKERS.items()
+                if breaker.failures
+            },
+            "prewarm_queue": scheduler.queue_depth if scheduler else None,
+            "request_duration": rss_mixer.REQUEST_DURATION.stats(),
+            "fetch_duration": rss_mixer.FETCH_DURATION.stats(),
+            "parse_duration": rss_mixer.PARSE_DURATION.stats(),
+        }
+
+    def get_prometheus_metrics(self):
+        feeds = [feed.get_metrics() for feed in rss_mixer.FEED_DATA.values()]
+        caches = (
+            ("feeds", rss_mixer.FEED_DATA.stats()),
+            ("responses", rss_mixer.RESPONSE_CACHE.stats()),
+            ("blocks", rss_mixer.BLOCKS_INDEX.stats()),
+        )
+        counters = rss_mixer.COUNTERS.stats()
+        metrics = [
+            (
+                "feed_events_total",
+                "counter",
+                "Events of the feeds (hits, misses, refreshes, failures...).",
+                [({"event": name}, value) for name, value in sorted(counters.items())],
+            ),
+            (
+                "collapsed_requests_total",
+                "counter",
+                "Retrieves that reused one already in progress.",
+                [({}, rss_mixer.COLLAPSED_REQUESTS["total"])],
+            ),
+        ]
+        for name, description in (
+            ("hits", "Cache hits."),
+            ("misses", "Cache misses."),
+            ("evictions", "Cache evictions."),
+        ):
+            metrics.append(
+                (
+                    f"cache_{name}_total",
+                    "counter",
+                    description,
+                    [({"cache": cache}, stats[name]) for cache, stats in caches],
+                )
+            )
+        metrics.append(
+            (
+                "cache_entries",
+                "gauge",
+                "Entries in the cache.",
+                [({"cache": cache}, stats["entries"]) for cache, stats in caches],
+            )
+        )
+        for name, metric_type, description in (
+            ("fetch_duration", "gauge", "Seconds of the last download of the feed."),
+            ("fetch_bytes", "gauge", "Bytes of the last download of the feed."),
+            ("parse_duration", "gauge", "Seconds of the last parse of the feed."),
+            ("items", "gauge", "Items of the feed."),
+            ("consecutive_failures", "gauge", "Consecutive failures of the feed."),
+        ):
+            metrics.append(
+                (
+                    f"feed_{name}",
+                    metric_type,
+                    description,
+                    [({"url": feed["url"]}, feed[name]) for feed in feeds],
+                )
+            )
+        for name, histogram, description in (
+            (
+                "request_duration_seconds",
+                rss_mixer.REQUEST_DURATION,
+                "Seconds to reply to @rss_mixer_data.",
+            ),
+            (
+                "fetch_duration_seconds",
+                rss_mixer.FETCH_DURATION,
+                "Seconds to download a feed.",
+            ),
+            (
+                "parse_duration_seconds",
+                rss_mixer.PARSE_DURATION,
+                "Seconds to parse a feed.",
+            ),
+        ):
+            metrics.append((name, "histogram", description, histogram.stats()))
+        return metrics
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Storages of the retrieved feeds, shared between processes.
+
+Every process keeps its feeds in RAM (see FEED_DATA in rss_mixer), and a
+storage lets the processes of the same host share them: only one process
+retrieves and parses a feed, and the others (or a restarted one) load it from
+the storage.
+"""
+from os import environ
+from redturtle.rssservice.interfaces import IFeedStorage
+from threading import local
+from time import time
+from uuid import uuid4
+from zope.component import queryUtility
+from zope.interface import implementer
+
+import json
+import logging
+import os
+import sqlite3
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+SQLITE_STORAGE_PATH = environ.get("RSS_SERVICE_SQLITE_STORAGE", "")
+
+# identifies this process as owner of the refresh locks
+OWNER = uuid4().hex
+
+_default_storage = None
+
+
+def get_feed_storage():
+    """Return the feed storage: a registered IFeedStorage utility, or the one
+    configured with environment variables."""
+    global _default_storage
+    storage = queryUtility(IFeedStorage)
+    if storage is not None:
+        return storage
+    if _default_storage is None:
+        if SQLITE_STORAGE_PATH:
+            _default_storage = SQLiteFeedStorage(path=SQLITE_STORAGE_PATH)
+        else:
+            _default_storage = FeedStorage()
+    return _default_storage
+
+
+@implementer(IFeedStorage)
+class FeedStorage(object):
+    """A storage that shares nothing: every process retrieves its feeds."""
+
+    def load(self, url, newer_than=0):
+        return None
+
+    def save(self, url, state):
+        pass
+
+    def touch(self, url, last_update):
+        pass
+
+    def acquire(self, url, timeout):
+        return True
+
+    def release(self, url):
+        pass
+
+
+@implementer(IFeedStorage)
+class SQLiteFeedStorage(FeedStorage):
+    """Store feeds in a SQLite database, shared by the processes of a host.
+
+    Items are stored as compressed JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self.connection as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS feeds ("
+                "url TEXT PRIMARY KEY, last_update REAL, title TEXT, "
+                "siteurl TEXT, etag TEXT, last_modified TEXT, interval REAL, "
+                "items_limit INTEGER, items BLOB)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                "url TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+            )
+
+    @property
+    def connection(self):
+        # sqlite connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, url, newer_than=0):
+        """Return the stored state of the feed if it was updated after
+        newer_than (seconds since epoch), else None."""
+        try:
+            row = self.connection.execute(
+                "SELECT last_update, title, siteurl, etag, last_modified, "
+                "interval, items_limit, items FROM feeds "
+                "WHERE url = ? AND last_update > ?",
+                (url, newer_than),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Unable to load %s from %s: %s", url, self.path, e)
+            return None
+        if row is None:
+            return None
+        try:
+            items = json.loads(zlib.decompress(row[7]))
+        except (zlib.error, ValueError) as e:
+            logger.warning("Unable to load %s from %s: %s", url, self.path, e)
+            return None
+        return {
+            "last_update": row[0],
+            "title": row[1],
+            "siteurl": row[2],
+            "etag": row[3],
+            "last_modified": row[4],
+            "interval": row[5],
+            "items_limit": row[6],
+            "items": items,
+        }
+
+    def save(self, url, state):
+        items = zlib.compress(
+            json.dumps(state["items"], separators=(",", ":")).encode("utf-8")
+        )
+        try:
+            with self.connection as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        url,
+                        state["last_update"],
+                        state["title"],
+                        state["siteurl"],
+                        state["etag"],
+                        state["last_modified"],
+                        state["interval"],
+                        state["items_limit"],
+                        items,
+                    ),
+                )
+        except sqlite3.Error as e:
+            logger.warning("Unable to save %s in %s: %s", url, self.path, e)
+
+    def touch(self, url, last_update):
+        """Mark the stored feed as updated, without changing its items."""
+        try:
+            with self.connection as connection:
+                connection.execute(
+                    "UPDATE feeds SET last_update = ? WHERE url = ?",
+                    (last_update, url),
+                )
+        except sqlite3.Error as e:
+            logger.warning("Unable to update %s in %s: %s", url, self.path, e)
+
+    def acquire(self, url, timeout):
+        """Try to get the lock to refresh the feed, for timeout seconds.
+
+        Return False if another process holds it.
+        """
+        now = time()
+        try:
+            with self.connection as connection:
+                cursor = connection.execute(
+                    "INSERT INTO locks VALUES (?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET "
+                    "owner = excluded.owner, expires = excluded.expires "
+                    "WHERE locks.expires < ?",
+                    (url, OWNER, now + timeout, now),
+                )
+                return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.warning("Unable to lock %s in %s: %s", url, self.path, e)
+            # better a duplicated retrieve than none
+            return True
+
+    def release(self, url):
+        try:
+            with self.connection as connection:
+                connection.execute(
+                    "DELETE FROM locks WHERE url = ? AND owner = ?", (url, OWNER)
+                )
+        except sqlite3.Error as e:
+            logger.warning("Unable to unlock %s in %s: %s", url, self.path, e)
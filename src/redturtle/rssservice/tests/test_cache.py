@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.cache import BoundedCache
+from unittest import mock
+
+import unittest
+
+
+class BoundedCacheTest(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = BoundedCache()
+        cache["foo"] = 1
+
+        self.assertEqual(cache.get("foo"), 1)
+        self.assertEqual(cache.get("bar"), None)
+        self.assertEqual(cache.setdefault("bar", 2), 2)
+        self.assertEqual(cache.setdefault("bar", 3), 2)
+        self.assertEqual(
+            cache.stats(),
+            {"entries": 2, "size": 0, "hits": 2, "misses": 1, "evictions": 0},
+        )
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = BoundedCache(max_entries=2)
+        cache["foo"] = 1
+        cache["bar"] = 2
+        cache.get("foo")
+        cache["baz"] = 3
+
+        self.assertEqual(sorted(cache.keys()), ["baz", "foo"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_entries_are_evicted_when_too_big(self):
+        cache = BoundedCache(max_size=10, sizeof=len)
+        cache["foo"] = "x" * 4
+        cache["bar"] = "x" * 4
+        self.assertEqual(cache.size, 8)
+
+        cache["baz"] = "x" * 4
+        self.assertEqual(sorted(cache.keys()), ["bar", "baz"])
+        self.assertEqual(cache.size, 8)
+
+        # the most recent entry is kept even if it's too big
+        cache["big"] = "x" * 20
+        self.assertEqual(cache.keys(), ["big"])
+        self.assertEqual(cache.size, 20)
+
+    def test_values_are_measured_again_when_read(self):
+        cache = BoundedCache(sizeof=len)
+        value = []
+        cache["foo"] = value
+        value.extend([1, 2, 3])
+        self.assertEqual(cache.size, 0)
+
+        cache.get("foo")
+        self.assertEqual(cache.size, 3)
+
+    def test_idle_entries_are_dropped(self):
+        cache = BoundedCache(max_idle=60)
+        with mock.patch("redturtle.rssservice.cache.time", return_value=1000):
+            cache["foo"] = 1
+            cache["bar"] = 2
+        with mock.patch("redturtle.rssservice.cache.time", return_value=1050):
+            cache.get("bar")
+        with mock.patch("redturtle.rssservice.cache.time", return_value=1100):
+            self.assertEqual(cache.get("foo"), None)
+            self.assertEqual(cache.get("bar"), 2)
+        self.assertEqual(cache.evictions, 1)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.circuitbreaker import CircuitBreaker
+from unittest import mock
+
+import unittest
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    @mock.patch("redturtle.rssservice.circuitbreaker.time", return_value=1000)
+    def test_retries_are_delayed_with_exponential_backoff(self, mock_time):
+        breaker = CircuitBreaker(threshold=5, base_delay=10, max_delay=30)
+        self.assertTrue(breaker.allow())
+
+        breaker.failure()
+        self.assertTrue(1005 <= breaker.retry_time <= 1010)
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertTrue(1010 <= breaker.retry_time <= 1020)
+        breaker.failure()
+        breaker.failure()
+        # bounded by max_delay
+        self.assertTrue(1015 <= breaker.retry_time <= 1030)
+        self.assertEqual(breaker.state, "closed")
+
+        mock_time.return_value = 1031
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.failures, 0)
+        self.assertTrue(breaker.allow())
+
+    @mock.patch("redturtle.rssservice.circuitbreaker.time", return_value=1000)
+    def test_open_circuit_allows_a_single_probe(self, mock_time):
+        breaker = CircuitBreaker(threshold=2, base_delay=10, probe_timeout=5)
+        breaker.failure()
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        mock_time.return_value = 1021
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        # the others fail fast while the probe is in progress
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+
+        mock_time.return_value = 1100
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
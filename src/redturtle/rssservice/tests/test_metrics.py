@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.metrics import Counters
+from redturtle.rssservice.metrics import Histogram
+from redturtle.rssservice.metrics import prometheus_text
+
+import unittest
+
+
+class MetricsTest(unittest.TestCase):
+    def test_counters(self):
+        counters = Counters()
+        counters.incr("hits")
+        counters.incr("hits", 2)
+        self.assertEqual(counters.get("hits"), 3)
+        self.assertEqual(counters.get("misses"), 0)
+        self.assertEqual(counters.stats(), {"hits": 3})
+        counters.clear()
+        self.assertEqual(counters.stats(), {})
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value)
+        stats = histogram.stats()
+        self.assertEqual(stats["count"], 4)
+        self.assertAlmostEqual(stats["sum"], 4.05)
+        self.assertEqual(stats["buckets"], {"0.1": 1, "1": 3, "+Inf": 4})
+
+    def test_prometheus_text(self):
+        histogram = Histogram(buckets=(1,))
+        histogram.observe(0.5)
+        text = prometheus_text(
+            [
+                (
+                    "feed_items",
+                    "gauge",
+                    "Items of the feed.",
+                    [({"url": 'http://foo.com/"RSS"'}, 2), ({"url": "x"}, None)],
+                ),
+                ("duration_seconds", "histogram", "Duration.", histogram.stats()),
+            ]
+        )
+        self.assertEqual(
+            text,
+            "# HELP rssmixer_feed_items Items of the feed.\n"
+            "# TYPE rssmixer_feed_items gauge\n"
+            'rssmixer_feed_items{url="http://foo.com/\\"RSS\\""} 2\n'
+            "# HELP rssmixer_duration_seconds Duration.\n"
+            "# TYPE rssmixer_duration_seconds histogram\n"
+            'rssmixer_duration_seconds_bucket{le="1"} 1\n'
+            'rssmixer_duration_seconds_bucket{le="+Inf"} 1\n'
+            "rssmixer_duration_seconds_sum 0.5\n"
+            "rssmixer_duration_seconds_count 1\n",
+        )
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.parsers import fast_parse
+from redturtle.rssservice.parsers import parse_feed
+from redturtle.rssservice.parsers import UnsupportedFeed
+from unittest import mock
+
+import feedparser
+import unittest
+
+
+RSS_FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/"
+     xmlns:media="http://search.yahoo.com/mrss/">
+<channel>
+<title>RSS FOO</title>
+<link>http://test.com</link>
+<ttl>30</ttl>
+<item>
+<title>Foo &amp; News 1</title>
+<link>http://test.com/foo-news-1</link>
+<description><![CDATA[<p onclick="alert()">some <b>description</b></p>]]></description>
+<pubDate>Thu, 2 Apr 2020 10:44:01 +0200</pubDate>
+<category>foo</category>
+<category>bar</category>
+<enclosure url="http://test.com/foo.jpg" type="image/jpeg" length="1000"/>
+</item>
+<item>
+<title>Foo News 2</title>
+<link>http://test.com/foo-news-2</link>
+<dc:date>2020-04-01T10:44:01Z</dc:date>
+<media:group><media:thumbnail url="http://test.com/thumb.jpg"/></media:group>
+</item>
+</channel>
+</rss>
+"""
+
+ATOM_FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title>ATOM FOO</title>
+<link href="http://test.com"/>
+<entry>
+<title type="html">Foo &lt;i&gt;News&lt;/i&gt; 1</title>
+<link rel="alternate" href="http://test.com/foo-news-1"/>
+<content type="html">&lt;p&gt;some&lt;script&gt;x()&lt;/script&gt;&lt;/p&gt;</content>
+<updated>2020-04-02T10:44:01Z</updated>
+<category term="foo"/>
+</entry>
+</feed>
+"""
+
+
+class FastParserTest(unittest.TestCase):
+    def assertSameFields(self, content):
+        """The fast parser returns what feedparser returns for the fields
+        used by the mixer."""
+        expected = feedparser.parse(content)
+        parsed = fast_parse(content)
+        for key in ("title", "link", "ttl"):
+            self.assertEqual(parsed.feed.get(key), expected.feed.get(key))
+        self.assertEqual(len(parsed["items"]), len(expected["items"]))
+        for item, expected_item in zip(parsed["items"], expected["items"]):
+            for key in (
+                "title",
+                "link",
+                "description",
+                "updated",
+                "published",
+                "updated_parsed",
+                "published_parsed",
+            ):
+                self.assertEqual(item.get(key), expected_item.get(key))
+            for key, attribute in (
+                ("tags", "term"),
+                ("links", "href"),
+                ("media_thumbnail", "url"),
+                ("media_content", "url"),
+            ):
+                self.assertEqual(
+                    [x.get(attribute) for x in item.get(key, [])],
+                    [x.get(attribute) for x in expected_item.get(key, [])],
+                )
+
+    def test_rss(self):
+        self.assertSameFields(RSS_FEED)
+
+    def test_atom(self):
+        self.assertSameFields(ATOM_FEED)
+
+    def test_truncated_feed(self):
+        content = RSS_FEED[: RSS_FEED.index(b"</item>") + len(b"</item>")]
+        with self.assertRaises(SyntaxError):
+            fast_parse(content)
+        parsed = fast_parse(content, truncated=True)
+        self.assertEqual(parsed.bozo, 0)
+        self.assertEqual(len(parsed["items"]), 1)
+
+    def test_unsupported_feeds(self):
+        with self.assertRaises(UnsupportedFeed):
+            fast_parse(
+                b'<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"/>'
+            )
+        with self.assertRaises(SyntaxError):
+            fast_parse(b"<rss><channel><title>&nbsp;</title></channel></rss>")
+
+    @mock.patch("redturtle.rssservice.parsers.PARSER", "fast")
+    def test_fallback_to_feedparser(self):
+        with mock.patch("feedparser.parse") as mock_parse:
+            parse_feed(RSS_FEED)
+            mock_parse.assert_not_called()
+        parsed = parse_feed(b"<rss><channel><title>&nbsp;Foo</title></channel></rss>")
+        self.assertEqual(parsed.feed.title, "Foo")
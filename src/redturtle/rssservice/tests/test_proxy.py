@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+from http.client import HTTPConnection
+from redturtle.rssservice.proxycacheserver.main import cache_path
+from redturtle.rssservice.proxycacheserver.main import fetch_and_cache
+from redturtle.rssservice.proxycacheserver.main import HOT_CACHE
+from redturtle.rssservice.proxycacheserver.main import LAST_ACCESS_TIMES
+from redturtle.rssservice.proxycacheserver.main import load_urls_from_cache
+from redturtle.rssservice.proxycacheserver.main import make_server
+from redturtle.rssservice.proxycacheserver.main import MAX_TTL_IN_CACHE
+from redturtle.rssservice.proxycacheserver.main import refresh_cache
+from redturtle.rssservice.session import get_session
+from threading import Event
+from threading import Thread
+from unittest import mock
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+
+SESSION = get_session()
+
+FEED = b"<rss version='2.0'><channel><title>Foo</title></channel></rss>"
+LAST_MODIFIED = "Thu, 02 Apr 2020 10:44:01 GMT"
+
+
+class MockResponse(object):
+    def __init__(self, content, status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {"Content-Type": "application/rss+xml"}
+        self.encoding = "utf-8"
+
+    def iter_content(self, chunk_size=1):
+        yield self.content
+
+    def close(self):
+        pass
+
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.release = Event()
+        self.feed = FEED
+        patcher = mock.patch.object(SESSION, "get", side_effect=self.mocked_get)
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = make_server(
+            "127.0.0.1", 0, self.cache_dir, ttl=3600, workers=4, keepalive_timeout=2
+        )
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def mocked_get(self, url, **kwargs):
+        if url == "http://slow.com/RSS":
+            self.release.wait(10)
+        if url == "http://etag.com/RSS":
+            if kwargs["headers"].get("If-None-Match") == '"foo"':
+                return MockResponse(b"", status_code=304)
+            return MockResponse(
+                self.feed,
+                headers={
+                    "Content-Type": "application/rss+xml",
+                    "ETag": '"foo"',
+                    "Last-Modified": LAST_MODIFIED,
+                },
+            )
+        return MockResponse(self.feed)
+
+    def get(self, connection, url, headers=None):
+        connection.request("GET", f"/{url}", headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def test_connections_are_kept_alive(self):
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.assertEqual(self.get(connection, "http://foo.com/RSS"), (200, FEED))
+        sock = connection.sock
+        self.assertEqual(self.get(connection, "http://foo.com/RSS"), (200, FEED))
+        self.assertIs(connection.sock, sock)
+        self.assertEqual(self.mock_get.call_count, 1)
+        connection.close()
+
+    def test_slow_fetch_does_not_block_cached_urls(self):
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.get(connection, "http://foo.com/RSS")
+
+        slow = HTTPConnection("127.0.0.1", self.port, timeout=10)
+        thread = Thread(target=self.get, args=(slow, "http://slow.com/RSS"))
+        thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        self.assertEqual(self.get(connection, "http://foo.com/RSS"), (200, FEED))
+        self.assertLess(time.time() - start, 1)
+        self.release.set()
+        thread.join()
+        connection.close()
+        slow.close()
+
+    def test_hits_are_served_from_memory_until_the_file_is_rewritten(self):
+        url = "http://foo.com/RSS"
+        cache_file = cache_path(url, self.cache_dir)
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.get(connection, url)
+        self.assertEqual(self.get(connection, url), (200, FEED))
+        self.assertIn(cache_file, HOT_CACHE)
+
+        with mock.patch("builtins.open") as mock_open:
+            self.assertEqual(self.get(connection, url), (200, FEED))
+            mock_open.assert_not_called()
+
+        self.feed = FEED.replace(b"Foo", b"Bar")
+        fetch_and_cache(url, self.cache_dir)
+        self.assertNotIn(cache_file, HOT_CACHE)
+        self.assertEqual(self.get(connection, url), (200, self.feed))
+        connection.close()
+
+    def test_concurrent_misses_schedule_a_single_refresh(self):
+        threads = [
+            Thread(
+                target=self.get,
+                args=(
+                    HTTPConnection("127.0.0.1", self.port, timeout=10),
+                    "http://slow.com/RSS",
+                ),
+            )
+            for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.scheduler.queue_depth, 1)
+        self.assertTrue(self.server.scheduler.is_scheduled("http://slow.com/RSS"))
+
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        status, body = self.get(connection, "_status")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["refresh_queue"], 1)
+        connection.close()
+
+    def test_refresh_cache(self):
+        url = "http://foo.com/RSS"
+        cache_file = cache_path(url, self.cache_dir)
+        now = time.time()
+        self.assertGreaterEqual(refresh_cache(url, self.cache_dir, ttl=60), now + 60)
+        self.assertTrue(os.path.exists(cache_file))
+
+        # not requested for too long: removed from the cache
+        LAST_ACCESS_TIMES[url] = now - MAX_TTL_IN_CACHE - 1
+        self.assertIsNone(refresh_cache(url, self.cache_dir, ttl=60))
+        self.assertFalse(os.path.exists(cache_file))
+        self.assertNotIn(url, LAST_ACCESS_TIMES)
+
+    def test_raw_bytes_are_stored_and_served(self):
+        url = "http://foo.com/RSS"
+        self.feed = "<rss><channel><title>Però</title></channel></rss>".encode(
+            "latin-1"
+        )
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.assertEqual(self.get(connection, url), (200, self.feed))
+        self.assertEqual(
+            os.listdir(self.cache_dir),
+            [os.path.basename(cache_path(url, self.cache_dir))],
+        )
+        # from the file and from memory
+        self.assertEqual(self.get(connection, url), (200, self.feed))
+        self.assertEqual(self.get(connection, url), (200, self.feed))
+
+        # without memory cache, sent from the file
+        HOT_CACHE.clear()
+        HOT_CACHE.max_size = 0
+        with mock.patch(
+            "socket.socket.sendfile", autospec=True, side_effect=socket.socket.sendfile
+        ) as mock_sendfile:
+            self.assertEqual(self.get(connection, url), (200, self.feed))
+            self.assertEqual(mock_sendfile.call_count, 1)
+        connection.close()
+
+    def test_legacy_cache_files_are_converted(self):
+        url = "http://foo.com/RSS"
+        legacy_file = cache_path(url, self.cache_dir).replace(".cache", ".json")
+        with open(legacy_file, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "url": url,
+                    "request_headers": {},
+                    "response_headers": {"Content-Type": "application/rss+xml"},
+                    "status_code": 200,
+                    "body": "Però",
+                },
+                f,
+                indent=2,
+            )
+        with open(os.path.join(self.cache_dir, "foo.tmp"), "w") as f:
+            f.write("half")
+
+        self.assertEqual(load_urls_from_cache(self.cache_dir), [url])
+        self.assertEqual(
+            os.listdir(self.cache_dir),
+            [os.path.basename(cache_path(url, self.cache_dir))],
+        )
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.assertEqual(self.get(connection, url), (200, "Però".encode("utf-8")))
+        self.mock_get.assert_not_called()
+        connection.close()
+
+    def test_refresh_revalidates_the_cached_response(self):
+        url = "http://etag.com/RSS"
+        fetch_and_cache(url, self.cache_dir, {})
+        self.assertNotIn("If-None-Match", self.mock_get.call_args[1]["headers"])
+
+        with mock.patch(
+            "redturtle.rssservice.proxycacheserver.main.write_cache_file"
+        ) as mock_write:
+            cache_content = fetch_and_cache(url, self.cache_dir)
+            mock_write.assert_not_called()
+        headers = self.mock_get.call_args[1]["headers"]
+        self.assertEqual(headers["If-None-Match"], '"foo"')
+        self.assertEqual(headers["If-Modified-Since"], LAST_MODIFIED)
+        self.assertEqual(cache_content["body"], FEED)
+        # the validators are not stored as request headers
+        fetch_and_cache(url, self.cache_dir)
+        with open(cache_path(url, self.cache_dir), "rb") as f:
+            self.assertNotIn(
+                "If-None-Match", json.loads(f.readline())["request_headers"]
+            )
+
+    def test_unchanged_content_is_not_written(self):
+        url = "http://foo.com/RSS"
+        fetch_and_cache(url, self.cache_dir, {})
+        with mock.patch(
+            "redturtle.rssservice.proxycacheserver.main.write_cache_file"
+        ) as mock_write:
+            fetch_and_cache(url, self.cache_dir)
+            mock_write.assert_not_called()
+            self.feed = FEED.replace(b"Foo", b"Bar")
+            fetch_and_cache(url, self.cache_dir)
+            mock_write.assert_called_once()
+
+    def test_conditional_requests_of_the_clients(self):
+        url = "http://etag.com/RSS"
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        # on a miss, the conditional request is not sent to the origin
+        self.assertEqual(
+            self.get(connection, url, {"If-None-Match": '"foo"'}), (304, b"")
+        )
+        self.assertNotIn("If-None-Match", self.mock_get.call_args[1]["headers"])
+
+        connection.request("GET", f"/{url}")
+        response = connection.getresponse()
+        self.assertEqual(response.read(), FEED)
+        self.assertEqual(response.headers["ETag"], '"foo"')
+        self.assertEqual(response.headers["Last-Modified"], LAST_MODIFIED)
+
+        self.assertEqual(
+            self.get(connection, url, {"If-None-Match": 'W/"foo"'}), (304, b"")
+        )
+        self.assertEqual(
+            self.get(connection, url, {"If-None-Match": '"bar"'}), (200, FEED)
+        )
+        self.assertEqual(
+            self.get(connection, url, {"If-Modified-Since": LAST_MODIFIED}),
+            (304, b""),
+        )
+        self.assertEqual(
+            self.get(
+                connection,
+                url,
+                {"If-Modified-Since": "Wed, 01 Apr 2020 10:44:01 GMT"},
+            ),
+            (200, FEED),
+        )
+        connection.close()
+
+    def test_queued_connections_are_closed_with_the_server(self):
+        self.server.server_close()
+        client, request = socket.socketpair()
+        with mock.patch.object(self.server, "RequestHandlerClass") as mock_handler:
+            self.server.process_request_thread(request, ("127.0.0.1", 0))
+            mock_handler.assert_not_called()
+        self.assertEqual(client.recv(1024), b"")
+        client.close()
+
+    def test_idle_connections_do_not_hold_the_workers(self):
+        url = "http://foo.com/RSS"
+        # more idle connections kept alive than workers
+        idle = [HTTPConnection("127.0.0.1", self.port, timeout=5) for i in range(6)]
+        for connection in idle:
+            self.assertEqual(self.get(connection, url), (200, FEED))
+
+        connection = HTTPConnection("127.0.0.1", self.port, timeout=5)
+        start = time.time()
+        self.assertEqual(self.get(connection, url), (200, FEED))
+        self.assertLess(time.time() - start, 1)
+        # the idle connections are still usable
+        sock = idle[0].sock
+        self.assertEqual(self.get(idle[0], url), (200, FEED))
+        self.assertIs(idle[0].sock, sock)
+
+        # and closed after keepalive_timeout seconds
+        time.sleep(3.5)
+        self.assertEqual(idle[1].sock.recv(1024), b"")
+        for connection in idle + [connection]:
+            connection.close()
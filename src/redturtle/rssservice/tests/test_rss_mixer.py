@@ -1,19 +1,45 @@
 # -*- coding: utf-8 -*-
+from persistent import Persistent
 from plone import api
 from plone.app.testing import setRoles
 from plone.app.testing import SITE_OWNER_NAME
 from plone.app.testing import SITE_OWNER_PASSWORD
 from plone.app.testing import TEST_USER_ID
 from plone.restapi.testing import RelativeSession
+from redturtle.rssservice.rss_mixer import BLOCKS_INDEX
+from redturtle.rssservice.rss_mixer import BREAKERS
 from redturtle.rssservice.rss_mixer import FEED_DATA
+from redturtle.rssservice.rss_mixer import FeedItem
+from redturtle.rssservice.rss_mixer import get_blocks_index
+from redturtle.rssservice.rss_mixer import get_breaker
+from redturtle.rssservice.rss_mixer import get_feed_interval
+from redturtle.rssservice.rss_mixer import get_snippet
+from redturtle.rssservice.rss_mixer import ItemsCounter
+from redturtle.rssservice.rss_mixer import next_prewarm_time
+from redturtle.rssservice.rss_mixer import normalize_date
+from redturtle.rssservice.rss_mixer import prewarm_feed
+from redturtle.rssservice.rss_mixer import REFRESHING
+from redturtle.rssservice.rss_mixer import RSSMixerFeed
+from redturtle.rssservice.rss_mixer import RSSMixerService
+from redturtle.rssservice.session import get_session
+from redturtle.rssservice.storage import SQLiteFeedStorage
 from redturtle.rssservice.testing import REDTURTLE_RSSSERVICE_API_FUNCTIONAL_TESTING
 from requests.exceptions import Timeout
+from threading import Thread
 from transaction import commit
 from unittest import mock
 
+import os
+import re
+import shutil
+import tempfile
+import time
 import unittest
 
 
+# mock the requests done to retrieve the feeds (but not the ones of the tests)
+SESSION = get_session()
+
 EXAMPLE_FEED_FOO = """
 <rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
 <channel>
@@ -152,11 +178,12 @@ EXAMPLE_FEED_WITH_CATEGORIES = """
 
 def mocked_requests_get(*args, **kwargs):
     class MockResponse:
-        def __init__(self, text, status_code, reason=""):
+        def __init__(self, text, status_code, reason="", headers=None):
             self.text = text
             self.content = text
             self.status_code = status_code
             self.reason = reason
+            self.headers = headers or {}
 
         def text(self):
             return self.text
@@ -164,10 +191,26 @@ def mocked_requests_get(*args, **kwargs):
         def content(self):
             return self.content
 
+        def iter_content(self, chunk_size=1):
+            content = self.content.encode("utf-8")
+            for start in range(0, len(content), chunk_size):
+                yield content[start : start + chunk_size]
+
+        def close(self):
+            pass
+
     if args[0] == "http://foo.com/RSS":
         return MockResponse(text=EXAMPLE_FEED_FOO, status_code=200)
     if args[0] == "http://bar.com/RSS":
         return MockResponse(text=EXAMPLE_FEED_BAR, status_code=200)
+    if args[0] == "http://etag.com/RSS":
+        if kwargs.get("headers", {}).get("If-None-Match") == '"foo"':
+            return MockResponse(text="", status_code=304)
+        return MockResponse(
+            text=EXAMPLE_FEED_FOO, status_code=200, headers={"ETag": '"foo"'}
+        )
+    if args[0] == "http://foo-updated.com/RSS":
+        return MockResponse(text=EXAMPLE_FEED_FOO_UPDATED, status_code=200)
     if args[0] == "http://test.com/timeout/RSS":
         raise Timeout
     if args[0] == "http://wrongdate.com/RSS":
@@ -177,6 +220,18 @@ def mocked_requests_get(*args, **kwargs):
     return MockResponse(text="Not Found", status_code=404)
 
 
+def mocked_slow_requests_get(*args, **kwargs):
+    time.sleep(1)
+    return mocked_requests_get(*args, **kwargs)
+
+
+def mocked_slow_updated_requests_get(*args, **kwargs):
+    time.sleep(1)
+    if args[0] == "http://foo.com/RSS":
+        return mocked_requests_get("http://foo-updated.com/RSS")
+    return mocked_requests_get(*args, **kwargs)
+
+
 class RSSSMixerTest(unittest.TestCase):
     layer = REDTURTLE_RSSSERVICE_API_FUNCTIONAL_TESTING
 
@@ -242,6 +297,8 @@ class RSSSMixerTest(unittest.TestCase):
         # invalidate cache
         for feed in FEED_DATA.values():
             feed._last_update_time_in_minutes = 0
+            feed._retry_time = 0
+        BREAKERS.clear()
         self.api_session.close()
 
     def get_feed_data(self, block_id):
@@ -295,17 +352,17 @@ class RSSSMixerTest(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_feed_single_result(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id-single")
         self.assertEqual(len(res), 2)
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_feed_mixed_result(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id")
         self.assertEqual(len(res), 4)
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_feed_results_are_sorted_by_date_descending(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id")
 
@@ -314,7 +371,7 @@ class RSSSMixerTest(unittest.TestCase):
         self.assertEqual(res[2]["title"], "Foo News 2")
         self.assertEqual(res[3]["title"], "Bar News 2")
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_return_source_info_in_feeds(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id-with-source")
 
@@ -323,13 +380,503 @@ class RSSSMixerTest(unittest.TestCase):
         self.assertEqual(res[2]["source"], "Foo site")
         self.assertEqual(res[3]["source"], "")
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_feed_wrong_date_format(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id-wrong-date")
         self.assertEqual(res[0]["date"], "07/03/2022 17.30 - 07/03/2022 19.00")
 
-    @mock.patch("requests.get", side_effect=mocked_requests_get)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
     def test_feed_categories(self, mock_get):
         res = self.get_feed_data(block_id="rss-block-id-catagories")
         self.assertEqual(res[0]["categories"], ["Category C"])
         self.assertEqual(res[1]["categories"], ["Category A", "Category B"])
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_slow_requests_get)
+    def test_feeds_are_retrieved_in_parallel(self, mock_get):
+        start = time.time()
+        res = self.get_feed_data(block_id="rss-block-id")
+        elapsed = time.time() - start
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertLess(elapsed, 1.9)
+        self.assertEqual(
+            [x["title"] for x in res],
+            ["Foo News 1", "Bar News 1", "Foo News 2", "Bar News 2"],
+        )
+
+    @mock.patch("redturtle.rssservice.rss_mixer.MAX_STALENESS", 60)
+    def test_stale_feed_is_served_while_refreshed_in_background(self):
+        with mock.patch.object(SESSION, "get", side_effect=mocked_requests_get):
+            res = self.get_feed_data(block_id="rss-block-id-single")
+        self.assertEqual(res[0]["title"], "Foo News 1")
+
+        feed = FEED_DATA["http://foo.com/RSS"]
+        # expired since one minute
+        feed._last_update_time_in_minutes = time.time() / 60 - feed.timeout - 1
+        with mock.patch.object(
+            SESSION, "get", side_effect=mocked_slow_updated_requests_get
+        ) as mock_get:
+            start = time.time()
+            res = self.get_feed_data(block_id="rss-block-id-single")
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(res[0]["title"], "Foo News 1")
+
+            # wait for the background refresh
+            while REFRESHING:
+                time.sleep(0.1)
+            self.assertEqual(mock_get.call_count, 1)
+
+        self.assertEqual(feed.items[0].title, "Foo News 1 UPDATED")
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_slow_requests_get)
+    def test_concurrent_updates_of_a_feed_do_a_single_request(self, mock_get):
+        feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+        threads = [Thread(target=feed.update) for x in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(feed.collapsed_requests, 4)
+        self.assertEqual(len(feed.items), 2)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_not_modified_feed_keeps_its_items(self, mock_get):
+        feed = RSSMixerFeed(url="http://etag.com/RSS", source="", timeout=100)
+        self.assertTrue(feed.update())
+        self.assertNotIn("If-None-Match", mock_get.call_args[1]["headers"])
+
+        items = feed.items
+        feed._last_update_time_in_minutes = 0
+        with mock.patch("feedparser.parse") as mock_parse:
+            self.assertTrue(feed.update())
+            mock_parse.assert_not_called()
+        self.assertEqual(mock_get.call_args[1]["headers"]["If-None-Match"], '"foo"')
+        self.assertIs(feed.items, items)
+        self.assertTrue(feed.ok)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_failing_host_is_retried_with_backoff(self, mock_get):
+        feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+        self.assertTrue(feed.update())
+        items = feed.items
+        breaker = get_breaker(feed.url)
+
+        feed._last_update_time_in_minutes = 0
+        mock_get.side_effect = Timeout
+        self.assertFalse(feed.update())
+        self.assertEqual(breaker.failures, 1)
+        self.assertEqual(feed.retry_time, breaker.retry_time)
+        # not retried until the backoff expires, the last items are served
+        self.assertFalse(feed.update())
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertIs(feed.items, items)
+        # the other feeds of the host fail fast
+        other = RSSMixerFeed(url="http://foo.com/other/RSS", source="", timeout=100)
+        self.assertFalse(other.update())
+        self.assertEqual(mock_get.call_count, 2)
+        # skipped, not failed
+        metrics = other.get_metrics()
+        self.assertEqual(metrics["circuit_open"], 1)
+        self.assertEqual(metrics["refreshes"], 0)
+        self.assertEqual(metrics["failures"], 0)
+        self.assertEqual(metrics["consecutive_failures"], 0)
+        self.assertEqual(feed.get_metrics()["failures"], 1)
+        # a refresh for each request sent
+        self.assertEqual(feed.get_metrics()["refreshes"], 2)
+
+        mock_get.side_effect = mocked_requests_get
+        breaker.retry_time = feed._retry_time = 0
+        self.assertTrue(feed.update())
+        self.assertEqual(breaker.failures, 0)
+        self.assertTrue(feed.ok)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_feed_is_retried_when_its_failing_host_can_be_requested(self, mock_get):
+        feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+        self.assertTrue(feed.update())
+        items = feed.items
+        # another feed of the host fails
+        other = RSSMixerFeed(url="http://foo.com/other/RSS", source="", timeout=100)
+        mock_get.side_effect = Timeout
+        self.assertFalse(other.update())
+        breaker = get_breaker(feed.url)
+
+        # expired, but not requested: its host is failing
+        feed._last_update_time_in_minutes = time.time() / 60 - 101
+        last_update = feed.last_update_time_in_minutes
+        self.assertTrue(feed.needs_update)
+        self.assertTrue(feed.update())
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(feed.last_update_time_in_minutes, last_update)
+        self.assertIs(feed.items, items)
+        self.assertTrue(feed.ok)
+        self.assertFalse(feed.needs_update)
+        self.assertEqual(feed.next_attempt_time, breaker.retry_time)
+        self.assertEqual(next_prewarm_time(feed), breaker.retry_time)
+
+        # requested again when the host can be retried
+        mock_get.side_effect = mocked_requests_get
+        later = breaker.retry_time + 1
+        with mock.patch("redturtle.rssservice.rss_mixer.time", return_value=later):
+            with mock.patch(
+                "redturtle.rssservice.circuitbreaker.time", return_value=later
+            ):
+                self.assertTrue(feed.needs_update)
+                self.assertTrue(feed.update())
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(feed.last_update_time_in_minutes, later / 60)
+        self.assertEqual(feed.next_attempt_time, 0)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_feed_download_stops_at_the_largest_limit(self, mock_get):
+        feed = RSSMixerFeed(url="http://etag.com/RSS", source="", timeout=100)
+        feed.max_limit = 1
+        self.assertTrue(feed.update())
+        self.assertEqual([item.title for item in feed.items], ["Foo News 1"])
+        self.assertFalse(feed.needs_update)
+
+        # a larger limit is requested: all the feed is retrieved again
+        feed.max_limit = 5
+        self.assertTrue(feed.needs_update)
+        self.assertTrue(feed.update())
+        self.assertNotIn("If-None-Match", mock_get.call_args[1]["headers"])
+        self.assertEqual(len(feed.items), 2)
+        self.assertFalse(feed.needs_update)
+
+    def test_items_are_counted_only_if_newest_first(self):
+        content = EXAMPLE_FEED_FOO.encode("utf-8")
+        counter = ItemsCounter(1)
+        self.assertTrue(counter(content))
+        truncated = counter.truncate(content)
+        self.assertTrue(
+            truncated.endswith(b"<guid>http://test.com/foo-news-1</guid>\n</item>")
+        )
+
+        # oldest first: all the feed is needed
+        content = content.replace(b"Thu, 1 Apr", b"Fri, 3 Apr")
+        counter = ItemsCounter(1)
+        self.assertFalse(counter(content))
+        self.assertFalse(counter.newest_first)
+        # also without dates
+        counter = ItemsCounter(1)
+        self.assertFalse(counter(re.sub(rb"<pubDate>.*</pubDate>", b"", content)))
+
+    def test_items_end_tags_in_cdata_are_not_counted(self):
+        content = EXAMPLE_FEED_FOO.replace(
+            "some description]]>", "some </item> description]]>"
+        ).encode("utf-8")
+        counter = ItemsCounter(1)
+        # the end of the first item is not enough
+        self.assertFalse(counter(content[: content.index(b"</item>\n<item>")]))
+        self.assertEqual(counter.count, 0)
+        self.assertTrue(counter(content[content.index(b"</item>\n<item>") :]))
+        self.assertEqual(counter.count, 2)
+        self.assertTrue(counter.truncate(content).endswith(b"</guid>\n</item>"))
+
+    @mock.patch("redturtle.rssservice.rss_mixer.MAX_ITEMS", 1)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_feed_items_are_capped(self, mock_get):
+        feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+        feed.max_limit = 10
+        self.assertTrue(feed.update())
+        self.assertEqual([item.title for item in feed.items], ["Foo News 1"])
+        # more items are requested, but no more are kept
+        self.assertFalse(feed.needs_update)
+
+    @mock.patch("redturtle.rssservice.rss_mixer.SNIPPET_LENGTH", 20)
+    def test_long_snippets_are_cut(self):
+        self.assertEqual(get_snippet("<p>short</p>"), "<p>short</p>")
+        # shorter without html
+        self.assertEqual(get_snippet("<p>short &amp; html</p>"), "short &amp; html")
+        self.assertEqual(
+            get_snippet("<p>a long <b>description</b> &amp; some\nhtml</p>"),
+            "a long description\u2026",
+        )
+        # the entities are not turned into markup
+        self.assertEqual(
+            get_snippet("<p>Some text &lt;img src=x onerror=alert(1)&gt; more</p>"),
+            "Some text &lt;img\u2026",
+        )
+        self.assertEqual(
+            get_snippet("<p>&lt;b&gt;bold&lt;/b&gt;</p>"), "&lt;b&gt;bold&lt;/b&gt;"
+        )
+
+    @mock.patch("redturtle.rssservice.session.MAX_BYTES", 100)
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_too_large_feed_fails(self, mock_get):
+        feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+        self.assertFalse(feed.update())
+        self.assertTrue(feed.update_failed)
+        self.assertEqual(feed.items, [])
+
+    def test_normalize_date(self):
+        parsed = time.strptime("2020-04-02 08:44:01", "%Y-%m-%d %H:%M:%S")
+        self.assertEqual(
+            normalize_date("Thu, 2 Apr 2020 10:44:01 +0200", parsed),
+            ("2020-04-02T08:44:01+00:00", 1585817041),
+        )
+        # not parsed by feedparser
+        self.assertEqual(
+            normalize_date("2020/04/02 10:44:01 GMT+2"),
+            ("2020-04-02T08:44:01+00:00", 1585817041),
+        )
+        self.assertEqual(normalize_date("yesterday"), ("yesterday", None))
+
+    def test_feed_item_is_serialized_as_dict(self):
+        data = {
+            "title": "Foo News 1",
+            "url": "http://test.com/foo-news-1",
+            "contentSnippet": "some description",
+            "source": "".join(["Foo", " site"]),
+            "date": "2020-04-02T08:44:01+00:00",
+            "enclosure": {"url": "http://test.com/foo.jpg"},
+            "categories": ["foo", "bar"],
+        }
+        item = FeedItem.from_dict(data)
+        self.assertEqual(item.timestamp, 1585817041)
+        self.assertIs(item.source, FeedItem.from_dict(data).source)
+        self.assertEqual(item.to_dict(), data)
+
+        item = FeedItem(title="Foo News 2", url="http://test.com/foo-news-2")
+        self.assertEqual(
+            item.to_dict(),
+            {
+                "title": "Foo News 2",
+                "url": "http://test.com/foo-news-2",
+                "contentSnippet": "",
+                "source": "",
+            },
+        )
+
+    def test_sorted_feeds_merge_items_by_date_with_undated_items_last(self):
+        class Feed(object):
+            def __init__(self, items):
+                self.items = items
+
+        foo = Feed(
+            [
+                FeedItem(title="foo 3", timestamp=3),
+                FeedItem(title="foo 1", timestamp=1),
+                FeedItem(title="foo undated"),
+            ]
+        )
+        bar = Feed(
+            [
+                FeedItem(title="bar 3", timestamp=3),
+                FeedItem(title="bar 2", timestamp=2),
+                FeedItem(title="bar undated"),
+            ]
+        )
+        service = RSSMixerService()
+
+        res = service._sortedFeeds(feeds=[foo, bar], limit=10)
+        self.assertEqual(
+            [x["title"] for x in res],
+            ["foo 3", "bar 3", "bar 2", "foo 1", "foo undated", "bar undated"],
+        )
+        res = service._sortedFeeds(feeds=[foo, bar], limit=3)
+        self.assertEqual([x["title"] for x in res], ["foo 3", "bar 3", "bar 2"])
+
+    def test_response_is_cached_until_a_feed_changes(self):
+        sorted_feeds = RSSMixerService._sortedFeeds
+        with mock.patch.object(
+            RSSMixerService, "_sortedFeeds", autospec=True, side_effect=sorted_feeds
+        ) as mock_sorted:
+            with mock.patch.object(SESSION, "get", side_effect=mocked_requests_get):
+                res = self.get_feed_data(block_id="rss-block-id")
+                self.assertEqual(res[0]["title"], "Foo News 1")
+                self.assertEqual(mock_sorted.call_count, 1)
+
+            # feeds not changed
+            self.assertEqual(self.get_feed_data(block_id="rss-block-id"), res)
+            self.assertEqual(mock_sorted.call_count, 1)
+
+            # foo feed changed
+            FEED_DATA["http://foo.com/RSS"]._last_update_time_in_minutes = 0
+            with mock.patch.object(
+                SESSION, "get", side_effect=mocked_slow_updated_requests_get
+            ):
+                res = self.get_feed_data(block_id="rss-block-id")
+                self.assertEqual(res[0]["title"], "Foo News 1 UPDATED")
+                self.assertEqual(mock_sorted.call_count, 2)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_response_has_cache_headers(self, mock_get):
+        url = "{}/@rss_mixer_data?block=rss-block-id".format(self.page.absolute_url())
+        response = self.api_session.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag)
+        self.assertIn("max-age=", response.headers["Cache-Control"])
+        self.assertIn("GMT", response.headers["Last-Modified"])
+
+        response = self.api_session.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = self.api_session.get(url, headers={"If-None-Match": '"xxx"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_stats(self, mock_get):
+        self.get_feed_data(block_id="rss-block-id")
+        response = self.api_session.get("/@rss_mixer_stats")
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        feeds = {feed["url"]: feed for feed in stats["feeds"]}
+        self.assertEqual(feeds["http://foo.com/RSS"]["items"], 2)
+        self.assertGreater(feeds["http://foo.com/RSS"]["fetch_bytes"], 0)
+        self.assertGreater(stats["counters"]["refreshes"], 0)
+        self.assertGreater(stats["request_duration"]["count"], 0)
+        self.assertIn("hits", stats["feeds_cache"])
+
+        response = self.api_session.get("/@rss_mixer_stats?format=prometheus")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn('rssmixer_feed_items{url="http://foo.com/RSS"} 2', response.text)
+        self.assertIn("rssmixer_request_duration_seconds_count", response.text)
+
+    def test_stats_are_not_public(self):
+        self.api_session.auth = None
+        response = self.api_session.get("/@rss_mixer_stats")
+        self.assertEqual(response.status_code, 401)
+        response = self.api_session.get("/@rss_mixer_stats?format=prometheus")
+        self.assertEqual(response.status_code, 401)
+
+    def test_blocks_index_is_updated_when_context_changes(self):
+        url = "{}/@rss_mixer_data?block=new-rss-block".format(self.page.absolute_url())
+        self.assertEqual(self.api_session.get(url).status_code, 404)
+
+        blocks = dict(self.page.blocks)
+        blocks["new-rss-block"] = {"@type": "foo"}
+        self.page.blocks = blocks
+        commit()
+        self.assertEqual(self.api_session.get(url).status_code, 400)
+
+        blocks["new-rss-block"] = {"@type": "rssBlock", "feeds": []}
+        self.page.blocks = blocks
+        commit()
+        response = self.api_session.get(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["message"], "Missing required parameter: feeds"
+        )
+
+    def test_blocks_index_of_a_ghost(self):
+        commit()
+        serial = self.page._p_serial
+        self.page._p_deactivate()
+        self.assertIsNotNone(get_blocks_index(self.page))
+        key = "/".join(self.page.getPhysicalPath())
+        self.assertEqual(BLOCKS_INDEX[key][0], serial)
+
+    def test_blocks_of_objects_not_stored_are_not_indexed(self):
+        class Page(Persistent):
+            def getPhysicalPath(self):
+                return ("", "plone", "not-stored")
+
+        page = Page()
+        page.blocks = {"rss": {"@type": "rssBlock", "feeds": []}}
+        self.assertIsNone(get_blocks_index(page))
+        self.assertNotIn("/plone/not-stored", BLOCKS_INDEX)
+
+    def test_feeds_are_shared_with_other_processes_by_the_storage(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage = SQLiteFeedStorage(path=os.path.join(directory, "feeds.sqlite"))
+        with mock.patch(
+            "redturtle.rssservice.rss_mixer.get_feed_storage", return_value=storage
+        ):
+            with mock.patch.object(
+                SESSION, "get", side_effect=mocked_requests_get
+            ) as mock_get:
+                feed = RSSMixerFeed(url="http://foo.com/RSS", source="", timeout=100)
+                self.assertTrue(feed.update())
+                self.assertEqual(mock_get.call_count, 1)
+
+                # the same feed in another process
+                other_feed = RSSMixerFeed(
+                    url="http://foo.com/RSS", source="", timeout=100
+                )
+                self.assertTrue(other_feed.update())
+                self.assertEqual(mock_get.call_count, 1)
+                self.assertEqual(other_feed.items, feed.items)
+                self.assertEqual(other_feed.title, "RSS FOO")
+
+    @mock.patch("redturtle.rssservice.rss_mixer.sleep")
+    def test_feed_is_retrieved_when_the_other_process_releases_the_lock(
+        self, mock_sleep
+    ):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage = SQLiteFeedStorage(path=os.path.join(directory, "feeds.sqlite"))
+        with mock.patch(
+            "redturtle.rssservice.rss_mixer.get_feed_storage", return_value=storage
+        ):
+            with mock.patch.object(
+                SESSION, "get", side_effect=mocked_requests_get
+            ) as mock_get:
+                # the other process fails to retrieve the feed
+                with mock.patch.object(
+                    storage, "acquire", side_effect=[False, False, True]
+                ):
+                    feed = RSSMixerFeed(
+                        url="http://foo.com/RSS", source="", timeout=100
+                    )
+                    self.assertTrue(feed.update())
+                self.assertEqual(mock_sleep.call_count, 2)
+                self.assertEqual(mock_get.call_count, 1)
+                self.assertEqual(feed.title, "RSS FOO")
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_prewarm_refreshes_feeds_before_they_expire(self, mock_get):
+        self.get_feed_data(block_id="rss-block-id-single")
+        self.assertEqual(mock_get.call_count, 1)
+        feed = FEED_DATA["http://foo.com/RSS"]
+
+        # not yet near to expire
+        next_time = prewarm_feed("http://foo.com/RSS")
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertAlmostEqual(next_time, feed.expiration_time - 60, delta=1)
+
+        # expires in 30 seconds
+        feed._last_update_time_in_minutes = time.time() / 60 - feed.timeout + 0.5
+        next_time = prewarm_feed("http://foo.com/RSS")
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertGreater(feed.expiration_time, time.time() + 60)
+
+        # feeds not used anymore are not refreshed
+        FEED_DATA.pop("http://foo.com/RSS")
+        self.assertIsNone(prewarm_feed("http://foo.com/RSS"))
+
+    @mock.patch.object(SESSION, "get", side_effect=mocked_requests_get)
+    def test_feeds_are_not_updated_before_their_interval(self, mock_get):
+        self.get_feed_data(block_id="rss-block-id")
+        self.get_feed_data(block_id="rss-block-id")
+        self.assertEqual(mock_get.call_count, 2)
+
+        feed = FEED_DATA["http://foo.com/RSS"]
+        self.assertEqual(feed.interval, feed.timeout)
+        # declared by the feed
+        feed._feed_interval = 5
+        feed._last_update_time_in_minutes = time.time() / 60 - 6
+        self.get_feed_data(block_id="rss-block-id")
+        self.assertEqual(mock_get.call_count, 3)
+
+    def test_feed_interval(self):
+        feed = {"feed": {"ttl": "30"}}
+        self.assertEqual(get_feed_interval(feed), 30)
+        feed = {"feed": {"sy_updateperiod": "daily", "sy_updatefrequency": "2"}}
+        self.assertEqual(get_feed_interval(feed), 720)
+        feed = {"feed": {"sy_updateperiod": "hourly"}, "max_age": 60}
+        self.assertEqual(get_feed_interval(feed), 60)
+        feed = {"feed": {}, "max_age": 600}
+        self.assertEqual(get_feed_interval(feed), 10)
+        self.assertIsNone(get_feed_interval({"feed": {}, "max_age": None}))
+        # too short or too long intervals are bounded
+        self.assertEqual(get_feed_interval({"feed": {"ttl": "1"}}), 5)
+        self.assertEqual(get_feed_interval({"feed": {"ttl": "100000"}}), 1440)
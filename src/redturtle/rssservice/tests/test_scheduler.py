@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.scheduler import RefreshScheduler
+from threading import Event
+from time import time
+
+import unittest
+
+
+class RefreshSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.runs = []
+        self.done = Event()
+        self.scheduler = RefreshScheduler(job=self.job, max_workers=2)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def job(self, key):
+        self.runs.append(key)
+        if len(self.runs) == 3:
+            self.done.set()
+        if key == "again" and self.runs.count("again") < 2:
+            return time()
+        return None
+
+    def test_keys_run_in_time_order(self):
+        now = time()
+        self.scheduler.schedule("second", now + 0.2)
+        self.scheduler.schedule("first", now + 0.1)
+        self.scheduler.schedule("third", now + 0.3)
+        self.assertEqual(self.scheduler.queue_depth, 3)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.runs, ["first", "second", "third"])
+        self.assertEqual(self.scheduler.queue_depth, 0)
+
+    def test_a_key_has_only_one_pending_run(self):
+        now = time()
+        self.assertTrue(self.scheduler.schedule("foo", now + 0.3))
+        self.assertFalse(self.scheduler.schedule("foo", now + 0.4))
+        # an earlier run replaces the scheduled one
+        self.assertTrue(self.scheduler.schedule("foo", now + 0.1))
+        self.scheduler.schedule("bar", now + 0.5)
+        self.scheduler.schedule("baz", now + 0.6)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.runs, ["foo", "bar", "baz"])
+
+    def test_job_can_schedule_the_next_run(self):
+        self.scheduler.schedule("again", time())
+        self.scheduler.schedule("last", time() + 0.5)
+
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.runs, ["again", "again", "last"])
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.session import DownloadError
+from redturtle.rssservice.session import read_content
+from unittest import mock
+
+import unittest
+
+
+class StreamedResponse(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class ReadContentTest(unittest.TestCase):
+    def test_read_content(self):
+        response = StreamedResponse([b"foo", b"bar"])
+        self.assertEqual(read_content(response), (b"foobar", False))
+        self.assertTrue(response.closed)
+
+    def test_too_large_content(self):
+        response = StreamedResponse([b"foo", b"bar", b"baz"])
+        with self.assertRaises(DownloadError):
+            read_content(response, max_bytes=5)
+        self.assertEqual(response.read, 2)
+        self.assertTrue(response.closed)
+
+    @mock.patch("redturtle.rssservice.session.time", side_effect=[0, 1, 11])
+    def test_too_slow_download(self, mock_time):
+        response = StreamedResponse([b"foo", b"bar", b"baz"])
+        with self.assertRaises(DownloadError):
+            read_content(response, deadline=10)
+        self.assertEqual(response.read, 2)
+
+    def test_download_stopped_early(self):
+        response = StreamedResponse([b"foo", b"bar", b"baz"])
+        content, stopped = read_content(response, stop=lambda chunk: chunk == b"bar")
+        self.assertEqual(content, b"foobar")
+        self.assertTrue(stopped)
+        self.assertTrue(response.closed)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from redturtle.rssservice.storage import SQLiteFeedStorage
+from unittest import mock
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+
+STATE = {
+    "last_update": 1000.0,
+    "title": "RSS FOO",
+    "siteurl": "http://test.com",
+    "etag": '"foo"',
+    "last_modified": None,
+    "interval": 60,
+    "items_limit": 0,
+    "items": [{"title": "Foo News 1", "url": "http://test.com/foo-news-1"}],
+}
+
+
+class SQLiteFeedStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "feeds.sqlite")
+        self.storage = SQLiteFeedStorage(path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_saved_state(self):
+        self.assertIsNone(self.storage.load("http://foo.com/RSS"))
+        self.storage.save("http://foo.com/RSS", STATE)
+
+        # another process
+        storage = SQLiteFeedStorage(path=self.path)
+        self.assertEqual(storage.load("http://foo.com/RSS"), STATE)
+        self.assertIsNone(storage.load("http://foo.com/RSS", newer_than=1000))
+
+        storage.touch("http://foo.com/RSS", last_update=2000.0)
+        state = self.storage.load("http://foo.com/RSS", newer_than=1000)
+        self.assertEqual(state["last_update"], 2000.0)
+        self.assertEqual(state["items"], STATE["items"])
+
+    def test_corrupted_items_are_not_loaded(self):
+        self.storage.save("http://foo.com/RSS", STATE)
+        with self.storage.connection as connection:
+            connection.execute("UPDATE feeds SET items = ?", (b"not compressed",))
+        self.assertIsNone(self.storage.load("http://foo.com/RSS"))
+
+        with self.storage.connection as connection:
+            connection.execute("UPDATE feeds SET items = ?", (zlib.compress(b"{"),))
+        self.assertIsNone(self.storage.load("http://foo.com/RSS"))
+
+    def test_only_one_process_at_a_time_gets_the_lock(self):
+        storage = SQLiteFeedStorage(path=self.path)
+        self.assertTrue(self.storage.acquire("http://foo.com/RSS", timeout=10))
+        with mock.patch("redturtle.rssservice.storage.OWNER", "another-process"):
+            self.assertFalse(storage.acquire("http://foo.com/RSS", timeout=10))
+            self.assertTrue(storage.acquire("http://bar.com/RSS", timeout=10))
+            # release only its own locks
+            storage.release("http://foo.com/RSS")
+            self.assertFalse(storage.acquire("http://foo.com/RSS", timeout=10))
+
+        self.storage.release("http://foo.com/RSS")
+        with mock.patch("redturtle.rssservice.storage.OWNER", "another-process"):
+            self.assertTrue(storage.acquire("http://foo.com/RSS", timeout=10))
+
+    def test_expired_lock_can_be_acquired(self):
+        self.assertTrue(self.storage.acquire("http://foo.com/RSS", timeout=-1))
+        with mock.patch("redturtle.rssservice.storage.OWNER", "another-process"):
+            self.assertTrue(self.storage.acquire("http://foo.com/RSS", timeout=10))